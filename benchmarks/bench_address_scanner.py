@@ -0,0 +1,133 @@
+"""
+Micro-benchmark of the address candidate extraction
+Compares the previous approach (BeautifulSoup + one find_all scan per regex) with PageDocument + AddressScanner
+and checks that both find the same candidates when a zip code overlaps a street address
+
+Run from the project root: python -m benchmarks.bench_address_scanner
+"""
+
+import random
+from timeit import timeit
+from bs4 import BeautifulSoup as bs
+
+from utils.document import PageDocument
+from utils.parser import AddressParser
+
+NUM_PAGES = 50
+REPEAT = 5
+
+# A zip code inside or right after a street match, both must still be found
+OVERLAP_CASES = [
+    "New York, NY 10001 - 350 Fifth Avenue",
+    "Suite 12345 Main Business Center Drive",
+]
+
+WORDS = "quality service team customers years experience solutions industry trusted local family owned".split()
+
+
+def make_page(seed):
+    """
+    Builds a company homepage like page: menu, content paragraphs, scripts and the address in the footer
+    :param seed: int
+    :return: str
+    """
+
+    rng = random.Random(seed)
+    menu = "".join(
+        f'<li><a href="/{w}">{w.title()}</a></li>' for w in rng.sample(WORDS, 6)
+    )
+    paragraphs = "".join(
+        f"<p>{' '.join(rng.choice(WORDS) for _ in range(rng.randint(10, 60)))}</p>"
+        for _ in range(rng.randint(40, 120))
+    )
+    scripts = "".join(
+        f"<script>var id{i} = {rng.randint(10000, 99999)};</script>" for i in range(5)
+    )
+    footer = (
+        f"<footer><p>{rng.randint(10, 9999)} North Business Park Street</p>"
+        f"<p>Springfield, IL {rng.randint(10000, 99999)}</p></footer>"
+    )
+    return f"<html><head>{scripts}<style>p {{}}</style></head><body><nav><ul>{menu}</ul></nav>{paragraphs}{footer}</body></html>"
+
+
+def two_scans_soup(address_parser, pages):
+    for page in pages:
+        soup = bs(page, "lxml")
+        for regex in [address_parser.street_regex, address_parser.zip_code_regex]:
+            for val in soup.find_all(string=regex):
+                if len(val) <= 100:
+                    break
+
+
+def single_pass(address_parser, pages):
+    scanner = address_parser.scanner
+    for page in pages:
+        scanner.best(scanner.scan(PageDocument(page)))
+
+
+def two_scans_document(address_parser, documents):
+    for document in documents:
+        address_parser.get_location(document, address_parser.street_regex, "")
+        address_parser.get_location(document, address_parser.zip_code_regex, "")
+
+
+def single_pass_document(address_parser, documents):
+    for document in documents:
+        address_parser.scanner.scan(document)
+
+
+def check_overlaps(address_parser):
+    """
+    Checks that the single pass finds the same street and zip code as the two scans on the overlap cases
+    :param address_parser: AddressParser
+    """
+
+    for text in OVERLAP_CASES:
+        document = PageDocument(f"<html><body><p>{text}</p></body></html>")
+        expected = (
+            address_parser.get_location(document, address_parser.street_regex, ""),
+            address_parser.get_location(document, address_parser.zip_code_regex, ""),
+        )
+        found = address_parser.scanner.best(address_parser.scanner.scan(document))
+        print(f"{text!r}: {found} {'ok' if found == expected else f'!= {expected}'}")
+
+
+def main():
+    address_parser = AddressParser()
+    pages = [make_page(seed) for seed in range(NUM_PAGES)]
+    documents = [PageDocument(page) for page in pages]
+
+    results = [
+        (
+            "parse + two scans (BeautifulSoup)",
+            timeit(lambda: two_scans_soup(address_parser, pages), number=REPEAT),
+        ),
+        (
+            "parse + single pass (PageDocument)",
+            timeit(lambda: single_pass(address_parser, pages), number=REPEAT),
+        ),
+        (
+            "scan only, two get_location calls",
+            timeit(
+                lambda: two_scans_document(address_parser, documents), number=REPEAT
+            ),
+        ),
+        (
+            "scan only, AddressScanner.scan",
+            timeit(
+                lambda: single_pass_document(address_parser, documents),
+                number=REPEAT,
+            ),
+        ),
+    ]
+
+    for name, seconds in results:
+        per_page = seconds / (NUM_PAGES * REPEAT) * 1000
+        print(f"{name:<40} {per_page:8.3f} ms/page")
+
+    print(f"\nSpeedup (parse + scan): {results[0][1] / results[1][1]:.2f}x\n")
+    check_overlaps(address_parser)
+
+
+if __name__ == "__main__":
+    main()
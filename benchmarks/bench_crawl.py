@@ -0,0 +1,175 @@
+"""
+End to end benchmark of the crawl -> parse -> geocode path, fully offline
+The websites are served by the local fixture server (benchmarks/fixture_server.py) and geocoding goes to
+LocalGeocoderBackend, so two runs on the same machine are comparable
+
+Every combination of concurrency and chunk size runs in a fresh process and reports domains/sec,
+the p50 / p99 crawl time per domain, the CPU time and the peak RSS of that process
+
+Run from the project root: python -m benchmarks.bench_crawl [--domains 200] [--min-rate 20]
+With --min-rate, the exit code is 1 if any setting is slower than that many domains/sec (regression gate),
+it is 1 as well if a setting crashed or ran longer than SETTING_TIMEOUT
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import resource
+import statistics
+import sys
+import time
+from multiprocessing import get_context
+
+from benchmarks.fixture_server import make_domains, start_server_process
+
+TIMEOUT = 2
+GEOCODER_LATENCY = 0.05  # seconds per lookup of the geocoder stand-in
+SETTING_TIMEOUT = 600  # seconds a setting may run before it counts as failed
+
+
+def run_setting(proxy, domains, concurrency, chunk_size, result):
+    """
+    Crawls, parses and geocodes the domains with one setting (runs in its own process)
+    :param proxy: str (url of the fixture server)
+    :param domains: list of str
+    :param concurrency: int (number of concurrent crawler threads)
+    :param chunk_size: int
+    :param result: multiprocessing Connection (the measurements are sent to it)
+    """
+
+    from threading import Semaphore
+
+    import main
+    from utils.crawler import WebsiteCrawler
+    from utils.geocoder import GeocodingService, LocalGeocoderBackend
+    from utils.parser import AddressParser
+    from utils.user_agent_provider import UserAgentProvider
+    from utils.logging_config import setup_logging
+
+    setup_logging("output/bench_crawl.log")
+    main.semaphore = Semaphore(concurrency)
+    crawler = WebsiteCrawler(
+        TIMEOUT, scheme="http", proxy=proxy, max_page_bytes=main.MAX_PAGE_BYTES
+    )
+    address_parser = AddressParser(
+        timeout=TIMEOUT,
+        geocoder=GeocodingService(
+            LocalGeocoderBackend(latency=GEOCODER_LATENCY),
+            rate=1000,
+            burst=100,
+            workers=8,
+        ),
+    )
+    user_agent_provider = UserAgentProvider(["benchmark"])
+
+    latencies = []
+    crawl_website = crawler.crawl_website
+
+    def timed_crawl_website(domain, user_agent, output_arr):
+        start = time.perf_counter()
+        crawl_website(domain, user_agent, output_arr)
+        latencies.append(time.perf_counter() - start)
+
+    crawler.crawl_website = timed_crawl_website
+
+    addresses = []
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for index in range(0, len(domains), chunk_size):
+            chunk = domains[index : index + chunk_size]
+            responses = main.crawl_websites(
+                chunk, chunk_size, user_agent_provider, crawler
+            )
+            address_parser.resolve_addresses(
+                [address_parser.extract_candidates(r) for r in responses], addresses
+            )
+
+    wall = time.perf_counter() - wall_start
+    percentiles = statistics.quantiles(latencies, n=100)
+
+    result.send(
+        {
+            "concurrency": concurrency,
+            "chunk_size": chunk_size,
+            "domains_per_sec": len(domains) / wall,
+            "p50": percentiles[49],
+            "p99": percentiles[98],
+            "cpu": time.process_time() - cpu_start,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "addresses": len(addresses),
+        }
+    )
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    arg_parser.add_argument("--domains", type=int, default=200)
+    arg_parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 40])
+    arg_parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[50, 100])
+    arg_parser.add_argument(
+        "--min-rate",
+        type=float,
+        default=None,
+        help="fail if a setting crawls fewer domains per second",
+    )
+    args = arg_parser.parse_args()
+
+    os.makedirs("output", exist_ok=True)
+    server, proxy = start_server_process()
+    domains = make_domains(args.domains)
+    context = get_context("spawn")
+
+    print(
+        f"{'threads':>8} {'chunk':>6} {'domains/s':>10} {'p50 s':>7} {'p99 s':>7} {'cpu s':>7} {'rss MB':>7} {'found':>6}"
+    )
+
+    failed = False
+    for concurrency in args.concurrency:
+        for chunk_size in args.chunk_sizes:
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(
+                target=run_setting,
+                args=(proxy, domains, concurrency, chunk_size, sender),
+            )
+            process.start()
+            # the child holds the only write end now, recv fails instead of blocking if it dies
+            sender.close()
+            try:
+                if not receiver.poll(SETTING_TIMEOUT):
+                    raise TimeoutError
+                r = receiver.recv()
+            except (EOFError, TimeoutError):
+                # a crashed child is exiting on its own, a hung one is stopped
+                process.join(5)
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+                print(
+                    f"{concurrency:>8} {chunk_size:>6} failed (exit code {process.exitcode})"
+                )
+                failed = True
+                continue
+            process.join()
+
+            print(
+                f"{r['concurrency']:>8} {r['chunk_size']:>6} {r['domains_per_sec']:>10.1f} {r['p50']:>7.3f} {r['p99']:>7.3f} {r['cpu']:>7.2f} {r['peak_rss_mb']:>7.1f} {r['addresses']:>6}"
+            )
+            if args.min_rate and r["domains_per_sec"] < args.min_rate:
+                failed = True
+
+    server.terminate()
+
+    if failed:
+        print(
+            f"A setting failed or was slower than {args.min_rate} domains/sec"
+            if args.min_rate
+            else "A setting failed"
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
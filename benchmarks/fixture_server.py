@@ -0,0 +1,195 @@
+"""
+Local web server serving a corpus of company websites, so the crawler can be benchmarked without the internet
+The crawler reaches it as an HTTP proxy (WebsiteCrawler(..., scheme="http", proxy=...)): the requested host picks
+the website, so the domains do not need to resolve
+
+The corpus is generated from the domain name, the same domain always gets the same website:
+- "normal": homepage, about and contact pages, the address is on the contact page
+- "about": the address is on the about page
+- "slow": like "normal", every page takes SLOW_DELAY seconds to arrive
+- "not_found": every page is a 404
+- "redirect": the homepage redirects to another host, which serves a "normal" website
+- "huge": like "normal", with a homepage of about HUGE_PAGE_SIZE bytes
+- "no_address": homepage, about and contact pages without any address
+
+Run standalone from the project root: python -m benchmarks.fixture_server [port]
+"""
+
+import random
+import sys
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+from urllib.parse import urlsplit
+
+SLOW_DELAY = 1.0
+HUGE_PAGE_SIZE = 2 * 1024 * 1024
+
+# Share of every kind of website in the corpus
+KINDS = [
+    ("normal", 50),
+    ("about", 15),
+    ("slow", 10),
+    ("not_found", 10),
+    ("redirect", 5),
+    ("huge", 5),
+    ("no_address", 5),
+]
+
+WORDS = "quality service team customers years experience solutions industry trusted local family owned".split()
+
+
+def make_domains(count):
+    """
+    Returns the domains of the corpus
+    :param count: int
+    :return: list of str
+    """
+
+    return [f"company{index:05d}.test" for index in range(count)]
+
+
+def site_kind(host):
+    """
+    Picks the kind of website of a host, always the same for the same host
+    :param host: str
+    :return: str
+    """
+
+    if host.startswith("moved-"):
+        return "normal"
+
+    rng = random.Random(zlib.crc32(host.encode()))
+    return rng.choices([kind for kind, _ in KINDS], [w for _, w in KINDS])[0]
+
+
+def make_page(rng, title, paragraphs, address=None):
+    """
+    Builds a company page: menu with the about / contact links, content and the address in the footer
+    :param rng: random.Random
+    :param title: str
+    :param paragraphs: int
+    :param address: tuple (street, city line) or None
+    :return: str
+    """
+
+    menu = '<nav><ul><li><a href="/">Home</a></li><li><a href="/about-us">About</a></li><li><a href="/contact">Contact</a></li></ul></nav>'
+    content = "".join(
+        f"<p>{' '.join(rng.choice(WORDS) for _ in range(rng.randint(10, 60)))}</p>"
+        for _ in range(paragraphs)
+    )
+    footer = (
+        f"<footer><p>{address[0]}</p><p>{address[1]}</p></footer>" if address else ""
+    )
+    return f"<html><head><title>{title}</title><script>var id = {rng.randint(1, 99999)};</script></head><body>{menu}{content}{footer}</body></html>"
+
+
+def make_response(host, path):
+    """
+    Builds the response of the server for a page
+    :param host: str
+    :param path: str
+    :return: tuple (status code, headers, body bytes, delay in seconds)
+    """
+
+    kind = site_kind(host)
+    rng = random.Random(zlib.crc32(f"{host}{path}".encode()))
+    address = (
+        f"{rng.randint(10, 9999)} North Business Park Street",
+        f"Springfield, IL {rng.randint(10000, 99999)}",
+    )
+    delay = SLOW_DELAY if kind == "slow" else 0
+
+    if kind == "not_found":
+        return 404, {}, b"<html><body><h1>404 Not Found</h1></body></html>", delay
+
+    if kind == "redirect" and path == "/":
+        return 301, {"Location": f"http://moved-{host}/"}, b"", delay
+
+    if path == "/":
+        paragraphs = rng.randint(20, 60)
+        if kind == "huge":
+            paragraphs = HUGE_PAGE_SIZE // 300
+        body = make_page(rng, host, paragraphs)
+    elif path == "/about-us":
+        body = make_page(rng, "About", 10, address if kind == "about" else None)
+    elif path == "/contact":
+        has_address = kind not in ("about", "no_address")
+        body = make_page(rng, "Contact", 5, address if has_address else None)
+    else:
+        return 404, {}, b"<html><body><h1>404 Not Found</h1></body></html>", delay
+
+    return 200, {"Content-Type": "text/html; charset=utf-8"}, body.encode(), delay
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        # as a proxy the request line holds the whole url, else the host comes from the Host header
+        parts = urlsplit(self.path)
+        host = (parts.hostname or self.headers.get("Host", "")).split(":")[0]
+        status, headers, body, delay = make_response(host, parts.path or "/")
+
+        if delay:
+            time.sleep(delay)
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionError:
+            pass  # the crawler gave up on the page (timeout)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer(ThreadingHTTPServer):
+    # the default listen backlog of 5 drops connections at benchmark concurrency,
+    # the benchmark would measure the server instead of the crawler
+    request_queue_size = 256
+
+
+def serve(port=0, ready=None):
+    """
+    Serves the corpus until the process is stopped
+    :param port: int (0 picks a free port)
+    :param ready: multiprocessing Connection (the port is sent to it once the server listens) or None
+    """
+
+    server = FixtureServer(("127.0.0.1", port), FixtureHandler)
+    server.daemon_threads = True
+    if ready:
+        ready.send(server.server_address[1])
+    server.serve_forever()
+
+
+def start_server_process():
+    """
+    Starts the server in its own process, so its CPU time is not counted in the benchmark
+    :return: tuple (multiprocessing Process, proxy url)
+    """
+
+    context = get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=serve, args=(0, sender), daemon=True)
+    process.start()
+    sender.close()
+    port = receiver.recv()
+    return process, f"http://127.0.0.1:{port}"
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    print(
+        f"Serving the fixture websites on http://127.0.0.1:{port} (use it as a proxy)"
+    )
+    serve(port)
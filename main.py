@@ -1,46 +1,119 @@
 from timeit import default_timer as timer
+
+STARTED_AT = timer()
+
+import argparse
+from contextlib import contextmanager
+from itertools import islice
+import os
+import socket
 from threading import Thread, Semaphore
 import sys
-from tkinter import Tk
-from tkinter.filedialog import askopenfilename
 from colorama import init as colorama_init
 from colorama import Fore, Style
-import numpy as np
 
-from utils.io_operations import IOHandler
-from utils.crawler import WebsiteCrawler
-from utils.user_agent_provider import UserAgentProvider
-from utils.parser import AddressParser
+# only light modules here, pandas, lxml, requests, aiohttp, geopy and tkinter are imported by the stages
+# that need them (see stage_imports), so a batch job starts fast
+from utils.logging_config import setup_logging
+from utils.geocode_cache import GeocodeCache
+from utils.checkpoint import Checkpoint
+from utils.crawl_cache import CrawlCache
+from utils.dns_resolver import DnsPrefilter
+from utils.metrics import metrics
+from utils.archive import CrawlArchive
+from utils.concurrency import AdaptiveController
+from utils.host_registry import HostRegistry
+from utils.shard_queue import ShardQueue
 
 TIMEOUT = 2  # timeout for requests
 NUM_THREADS = 40
 CHUNK_SIZE = 100  # number of websites to crawl at once
+CRAWLER_MODE = "threads"  # "threads" (one thread per domain) or "async" (pooled keep-alive connections)
+MAX_CONNECTIONS = 100  # global connection limit for the async crawler
+MAX_CONNECTIONS_PER_HOST = 4  # per host connection limit for the async crawler
+RUN_MODE = "chunks"  # "chunks" (crawl, then parse every chunk) or "pipeline" (streaming stages)
+NUM_PARSERS = 2  # number of parser workers in the pipeline
+QUEUE_SIZE = 100  # maximum number of items waiting in front of a pipeline stage
+PARSE_MODE = "serial"  # "serial" (main process) or "processes" (HTML parsing spread over all the cores)
+PARSER_PROCESSES = None  # number of parser processes, None means one per core
+GEOCODER_BACKEND = "nominatim"  # "nominatim" or "local" (offline stand-in, for tests)
+GEOCODE_RATE = 1.0  # maximum number of geocoder requests per second
+GEOCODE_WORKERS = 2  # number of concurrent geocoder requests
+GEOCODE_CACHE_PATH = "output/geocode_cache.sqlite"  # None disables the geocode cache
+GAZETTEER_INDEX = None  # directory of an index built with "python -m utils.gazetteer", None disables it
+GAZETTEER_COUNTRY = "US"  # preferred when a postcode exists in several countries
+PAGE_STORE_PATH = None  # e.g. "output/pages.segment" spools the crawled pages to disk, None keeps them in memory
+PAGE_STORE_TEXT_ONLY = False  # store only the visible text of the pages
+CRAWL_CACHE_PATH = None  # e.g. "output/crawl_cache.sqlite" skips the pages unchanged since the previous run
+PAGE_BUDGET = 5  # maximum number of about / contact pages fetched per website
+MAX_PAGE_BYTES = 1024 * 1024  # pages are cut at this size (None: no streaming)
+PARSE_WHILE_CRAWLING = False  # parse pages as they arrive, stop at the first address (threaded crawler only)
+STREAM_INPUT = False  # read the input parquet one row group at a time
+DNS_CACHE_PATH = "output/dns_cache.sqlite"  # None disables the DNS pre-resolution
+DNS_WORKERS = 64  # number of concurrent DNS resolutions
+DNS_DEAD_TTL = 24 * 60 * 60  # seconds a dead domain is skipped without resolving it
+ARCHIVE_PATH = "output/crawl.warc.gz"  # written by --record, read by --replay
+METRICS_PATH = "output/metrics.json"  # ".prom" for Prometheus text, None disables it
+METRICS_INTERVAL = None  # seconds between dumps while running (None: only at the end)
+ADAPTIVE_CONCURRENCY = True  # adapt the threads and timeouts (AIMD)
+MAX_THREADS = 200  # adaptive upper bound, a chunk has at most CHUNK_SIZE threads
+SHARD_SIZE = 1000  # number of domains per shard written by --coordinator
+SHARD_LEASE = 600  # seconds a worker keeps a shard without renewing its lease
+SHARD_DIR = "output/shards"  # checkpoints and outputs of the shards
 semaphore = Semaphore(NUM_THREADS)
+import_seconds = {}  # stage -> seconds spent importing its modules
+
+
+@contextmanager
+def stage_imports(stage):
+    """
+    Times the imports of a stage, they are reported with the startup time
+    :param stage: str
+    """
+
+    start = timer()
+    try:
+        yield
+    finally:
+        import_seconds[stage] = import_seconds.get(stage, 0) + timer() - start
 
 
-def crawl_website_with_semaphore(df_element, user_agent, responses):
+def crawl_website_with_semaphore(
+    crawler, df_element, user_agent, responses, address_parser=None
+):
     """
     Crawl website with semaphore
+    :param crawler: WebsiteCrawler
     :param df_element: element from the dataframe
     :param user_agent: str
     :param links: list
+    :param address_parser: AddressParser (if given, the pages are parsed while crawling and addresses are returned)
     """
 
-    semaphore.acquire()
+    # the adaptive controller replaces the fixed semaphore
+    limiter = crawler.controller or semaphore
+    limiter.acquire()
 
     try:
-        WebsiteCrawler(TIMEOUT).crawl_website(df_element, user_agent, responses)
+        if address_parser:
+            crawler.crawl_and_parse(df_element, user_agent, address_parser, responses)
+        else:
+            crawler.crawl_website(df_element, user_agent, responses)
     finally:
-        semaphore.release()
+        limiter.release()
 
 
-def crawl_websites(df, no_of_websites, user_agent_provider):
+def crawl_websites(
+    df, no_of_websites, user_agent_provider, crawler, address_parser=None
+):
     """
     Crawl the websites
     :param df: pandas dataframe
     :param no_of_websites: int
     :param user_agent_provider: UserAgentProvider
-    :return: list
+    :param crawler: WebsiteCrawler
+    :param address_parser: AddressParser (if given, the pages are parsed while crawling)
+    :return: list (of responses, or of addresses if address_parser is given)
     """
 
     threads = []
@@ -52,9 +125,11 @@ def crawl_websites(df, no_of_websites, user_agent_provider):
         t = Thread(
             target=crawl_website_with_semaphore,
             args=(
+                crawler,
                 element,
                 user_agent_provider.get_random_user_agent(),
                 responses,
+                address_parser,
             ),
         )
         t.start()
@@ -66,9 +141,310 @@ def crawl_websites(df, no_of_websites, user_agent_provider):
     return responses
 
 
+def crawl_in_chunks(
+    chunks,
+    total,
+    crawler,
+    address_parser,
+    user_agent_provider,
+    checkpoint,
+    dns_prefilter=None,
+):
+    """
+    Crawl the websites chunk by chunk, parsing every chunk after it was crawled
+    The addresses of every chunk are saved by the checkpoint as soon as the chunk is done
+    :param chunks: iterable of lists of domains
+    :param total: int (number of domains, for the progress messages)
+    :param crawler: WebsiteCrawler or AsyncWebsiteCrawler
+    :param address_parser: AddressParser
+    :param user_agent_provider: UserAgentProvider
+    :param checkpoint: Checkpoint
+    :param dns_prefilter: DnsPrefilter (if given, the dead domains of every chunk are not crawled)
+    """
+
+    current_index = 0
+    for group in chunks:
+        chunk_start = timer()
+        print(
+            f"{Fore.LIGHTGREEN_EX}[{current_index + 1}-{current_index + len(group)}] {Style.RESET_ALL}Crawling websites {current_index + 1}-{current_index + len(group)} out of {total}"
+        )
+
+        chunk_addresses = []
+
+        # the whole group is still committed below, the dead domains are finished too
+        alive = dns_prefilter.filter(group) if dns_prefilter else group
+
+        if PARSE_WHILE_CRAWLING:
+            # the addresses come straight out of the crawler threads
+            chunk_addresses = crawl_websites(
+                alive, CHUNK_SIZE, user_agent_provider, crawler, address_parser
+            )
+            checkpoint.commit_chunk(group, chunk_addresses)
+            metrics.observe("chunk_seconds", timer() - chunk_start)
+            current_index += len(group)
+            continue
+
+        # Crawl the websites and get the links
+        if CRAWLER_MODE == "async":
+            responses = crawler.crawl_websites(alive, user_agent_provider)
+        else:
+            responses = crawl_websites(alive, CHUNK_SIZE, user_agent_provider, crawler)
+
+        # Parse the addresses from the links
+        if PARSE_MODE == "processes":
+            list_of_candidates = address_parser.extract_candidates_many(responses)
+        else:
+            list_of_candidates = map(address_parser.extract_candidates, responses)
+
+        list_of_candidates = list(list_of_candidates)
+        for index in range(len(list_of_candidates)):
+            print(
+                f"{Fore.LIGHTGREEN_EX}[{current_index + index + 1}] {Style.RESET_ALL}Extracting address from {responses[index][0].get('domain')}{Style.RESET_ALL}"
+            )
+
+        # the websites are geocoded concurrently, behind the rate limit of the geocoding service
+        address_parser.resolve_addresses(list_of_candidates, chunk_addresses)
+
+        checkpoint.commit_chunk(group, chunk_addresses)
+        metrics.observe("chunk_seconds", timer() - chunk_start)
+        current_index += len(group)
+
+
+def replay_in_chunks(websites, address_parser, checkpoint):
+    """
+    Parses the websites of a crawl archive chunk by chunk, nothing is crawled
+    :param websites: iterable of lists of records (see CrawlArchive.replay)
+    :param address_parser: AddressParser
+    :param checkpoint: Checkpoint
+    :return: int (number of websites parsed)
+    """
+
+    websites = (
+        responses
+        for responses in websites
+        if responses and not checkpoint.is_done(responses[0].get("domain"))
+    )
+
+    total = 0
+    while True:
+        chunk = list(islice(websites, CHUNK_SIZE))
+        if not chunk:
+            break
+
+        print(
+            f"{Fore.LIGHTGREEN_EX}[{total + 1}-{total + len(chunk)}] {Style.RESET_ALL}Replaying websites {total + 1}-{total + len(chunk)}"
+        )
+
+        if PARSE_MODE == "processes":
+            list_of_candidates = address_parser.extract_candidates_many(chunk)
+        else:
+            list_of_candidates = [
+                address_parser.extract_candidates(responses) for responses in chunk
+            ]
+
+        chunk_addresses = []
+        address_parser.resolve_addresses(list_of_candidates, chunk_addresses)
+        checkpoint.commit_chunk(
+            [responses[0].get("domain") for responses in chunk], chunk_addresses
+        )
+        total += len(chunk)
+
+    return total
+
+
+def create_shards(io_handler, path, queue_path, host_registry):
+    """
+    Coordinator: splits the input domains into shards in a work queue, the workers crawl them
+    :param io_handler: IOHandler
+    :param path: str (input parquet file)
+    :param queue_path: str (SQLite file of the work queue)
+    :param host_registry: HostRegistry (the domains are deduplicated)
+    """
+
+    domains = list(host_registry.dedupe(io_handler.parse_parquet(path, "domain")))
+    shard_queue = ShardQueue(queue_path, SHARD_LEASE)
+    number_of_shards = shard_queue.create(domains, SHARD_SIZE)
+    shard_queue.close()
+    print(
+        f"Wrote {Fore.GREEN}{number_of_shards}{Style.RESET_ALL} shards ({len(domains)} domains) to {queue_path}, start the workers with: python3 main.py --worker {queue_path}"
+    )
+
+
+def work_on_shards(shard_queue, worker_id, io_handler, host_registry, crawl):
+    """
+    Worker: claims shards from the work queue and crawls them until none is left
+    Every shard has its own checkpoint in SHARD_DIR, a shard claimed again after a crash resumes where it stopped
+    Its addresses are written to a temporary file first, it only becomes the output of the shard while
+    the lease is still held, so a worker that lost its lease never overwrites the output of another worker
+    :param shard_queue: ShardQueue
+    :param worker_id: str
+    :param io_handler: IOHandler
+    :param host_registry: HostRegistry
+    :param crawl: function (chunks, total, checkpoint), crawls the domains and commits them to the checkpoint
+    :return: tuple (number of domains, number of addresses)
+    """
+
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    total = number_of_addresses = 0
+    while True:
+        shard = shard_queue.claim(worker_id)
+        if shard is None:
+            break
+
+        shard_id, domains = shard
+        shard_path = os.path.join(SHARD_DIR, f"shard-{shard_id:05d}")
+        print(
+            f"{Fore.LIGHTGREEN_EX}[shard {shard_id}] {Style.RESET_ALL}Claimed {len(domains)} domains"
+        )
+
+        checkpoint = Checkpoint(
+            io_handler,
+            f"{shard_path}.parts",
+            f"{shard_path}.manifest",
+            resume=True,
+            host_registry=host_registry,
+        )
+        domains = [domain for domain in domains if not checkpoint.is_done(domain)]
+        stop_renewing = shard_queue.keep_leased(shard_id, worker_id)
+        try:
+            crawl(
+                (
+                    domains[index : index + CHUNK_SIZE]
+                    for index in range(0, len(domains), CHUNK_SIZE)
+                ),
+                len(domains),
+                checkpoint,
+            )
+        finally:
+            stop_renewing.set()
+
+        temporary_path = f"{shard_path}.{worker_id}.parquet"
+        addresses = checkpoint.merge(temporary_path)
+        if shard_queue.renew(shard_id, worker_id):
+            os.replace(temporary_path, f"{shard_path}.parquet")
+            shard_queue.complete(shard_id, worker_id, f"{shard_path}.parquet")
+            total += len(domains)
+            number_of_addresses += addresses
+        else:
+            os.remove(temporary_path)
+            print(
+                f"{Fore.YELLOW}[shard {shard_id}] Lease lost, the shard was claimed by another worker{Style.RESET_ALL}"
+            )
+
+    return total, number_of_addresses
+
+
+def merge_shards(io_handler, queue_path, output_path):
+    """
+    Combines the outputs of the finished shards into the output file
+    :param io_handler: IOHandler
+    :param queue_path: str (SQLite file of the work queue)
+    :param output_path: str
+    """
+
+    shard_queue = ShardQueue(queue_path, SHARD_LEASE)
+    progress = shard_queue.progress()
+    if progress["pending"] or progress["leased"]:
+        print(
+            f"{Fore.YELLOW}WARNING: {progress['pending']} pending and {progress['leased']} leased shards, only the {progress['done']} finished shards are merged{Style.RESET_ALL}"
+        )
+
+    number_of_addresses = io_handler.concat_parquet(shard_queue.outputs(), output_path)
+    shard_queue.close()
+    print(
+        f"Merged {Fore.GREEN}{progress['done']}{Style.RESET_ALL} shards, {Fore.GREEN}{number_of_addresses}{Style.RESET_ALL} addresses"
+    )
+
+
 def main():
+    global TIMEOUT, NUM_THREADS, semaphore
     start = timer()
 
+    arg_parser = argparse.ArgumentParser(
+        description="Extract the addresses of a list of company websites"
+    )
+    arg_parser.add_argument(
+        "input",
+        nargs="?",
+        help="parquet file with a domain column (without it, a file dialog asks for one)",
+    )
+    arg_parser.add_argument(
+        "--output",
+        metavar="PATH",
+        help="parquet file the addresses are written to (default: output/addresses.snappy.parquet)",
+    )
+    arg_parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=NUM_THREADS,
+        help=f"number of websites crawled at once by the threaded crawler (default: {NUM_THREADS})"
+        + (
+            f", only the starting value with ADAPTIVE_CONCURRENCY, the controller moves it up to MAX_THREADS ({MAX_THREADS})"
+            if ADAPTIVE_CONCURRENCY
+            else ""
+        )
+        + f"; the async crawler uses MAX_CONNECTIONS ({MAX_CONNECTIONS}) instead",
+    )
+    arg_parser.add_argument(
+        "--timeout",
+        type=float,
+        default=TIMEOUT,
+        help=f"request timeout in seconds (default: {TIMEOUT})"
+        + (
+            ", only the starting value with ADAPTIVE_CONCURRENCY, the threaded crawler then derives it from the recent latencies"
+            if ADAPTIVE_CONCURRENCY
+            else ""
+        ),
+    )
+    arg_parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip the domains already finished by the previous (crashed) run",
+    )
+    mode = arg_parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--record",
+        action="store_true",
+        help=f"write every fetched page to the crawl archive ({ARCHIVE_PATH})",
+    )
+    mode.add_argument(
+        "--replay",
+        nargs="?",
+        const=ARCHIVE_PATH,
+        metavar="ARCHIVE",
+        help="parse the pages of a crawl archive instead of crawling",
+    )
+    mode.add_argument(
+        "--coordinator",
+        metavar="QUEUE",
+        help=f"split the input into shards of {SHARD_SIZE} domains in the QUEUE work queue (SQLite file) and exit",
+    )
+    mode.add_argument(
+        "--worker",
+        metavar="QUEUE",
+        help="crawl the shards of the QUEUE work queue until none is left (start as many workers as needed)",
+    )
+    mode.add_argument(
+        "--merge",
+        metavar="QUEUE",
+        help="combine the outputs of the finished shards of the QUEUE work queue into the output file",
+    )
+    args = arg_parser.parse_args()
+
+    TIMEOUT = args.timeout
+    NUM_THREADS = args.concurrency
+    semaphore = Semaphore(NUM_THREADS)
+
+    metrics_path = METRICS_PATH
+    if args.worker:
+        # the workers of a machine share the output directory, every one has its own log and metrics
+        worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        setup_logging(f"output/app-{worker_id}.log")
+        if METRICS_PATH:
+            root, extension = os.path.splitext(METRICS_PATH)
+            metrics_path = f"{root}-{worker_id}{extension}"
+    else:
+        setup_logging()
     colorama_init()
 
     def print_error_and_exit(error_message):
@@ -88,22 +464,34 @@ def main():
 
     print(logo)
 
-    # Create the Tkinter root
-    Tk().withdraw()
+    waited = 0  # seconds spent in the file dialog, not counted in the startup time
+    if args.input:
+        path = args.input
+    elif args.coordinator:
+        print_error_and_exit("The coordinator needs the input file")
+    elif not (args.replay or args.worker or args.merge):
+        with stage_imports("dialog"):
+            from tkinter import Tk
+            from tkinter.filedialog import askopenfilename
 
-    # Ask the user to select a file
-    print(
-        f"{Fore.CYAN}INPUT: Please select the file containing the list of company websites\n{Style.RESET_ALL}"
-    )
+        # Create the Tkinter root
+        Tk().withdraw()
 
-    path = askopenfilename(
-        title="Choose the file containing the list of company websites",
-    )
+        # Ask the user to select a file
+        print(
+            f"{Fore.CYAN}INPUT: Please select the file containing the list of company websites\n{Style.RESET_ALL}"
+        )
 
-    if path:
-        print(f"File loaded successfully: {path}")
-    else:
-        print_error_and_exit("No file selected")
+        dialog_start = timer()
+        path = askopenfilename(
+            title="Choose the file containing the list of company websites",
+        )
+        waited = timer() - dialog_start
+
+        if path:
+            print(f"File loaded successfully: {path}")
+        else:
+            print_error_and_exit("No file selected")
 
     try:
         print("Loading user agents")
@@ -112,47 +500,230 @@ def main():
     except:
         print_error_and_exit("Could not load user agents")
 
-    # Initialize handlers and providers
-    io_handler = IOHandler()
-    user_agent_provider = UserAgentProvider(user_agents)
-    address_parser = AddressParser(timeout=TIMEOUT)
+    with stage_imports("input"):
+        from utils.io_operations import IOHandler, OUTPUT_PARQUET
 
-    # Read the domain data from the parquet file
-    df = io_handler.parse_parquet(path, "domain")
-    list_of_addresses = []
+    io_handler = IOHandler()
+    output_path = args.output or OUTPUT_PARQUET
+    host_registry = HostRegistry()
+
+    if args.coordinator:
+        create_shards(io_handler, path, args.coordinator, host_registry)
+        return
+    if args.merge:
+        merge_shards(io_handler, args.merge, output_path)
+        return
+
+    with stage_imports("parse"):
+        from utils.parser import AddressParser
+        from utils.geocoder import (
+            GeocodingService,
+            NominatimBackend,
+            LocalGeocoderBackend,
+        )
 
-    df = df.reset_index(drop=True)
+        if GAZETTEER_INDEX:
+            from utils.gazetteer import PostcodeGazetteer
+        if PARSE_MODE == "processes":
+            from utils.parallel_parser import ParallelAddressParser
 
-    groups = df.groupby(
-        np.arange(len(df)) // CHUNK_SIZE
-    )  # Split the dataframe into chunks
+    # Initialize handlers and providers
+    geocode_cache = GeocodeCache(GEOCODE_CACHE_PATH) if GEOCODE_CACHE_PATH else None
+    gazetteer = (
+        PostcodeGazetteer.load(GAZETTEER_INDEX, GAZETTEER_COUNTRY)
+        if GAZETTEER_INDEX
+        else None
+    )
+    crawl_cache = CrawlCache(CRAWL_CACHE_PATH) if CRAWL_CACHE_PATH else None
+    dns_prefilter = (
+        DnsPrefilter(DNS_CACHE_PATH, ttl=DNS_DEAD_TTL, num_workers=DNS_WORKERS)
+        if DNS_CACHE_PATH
+        else None
+    )
+    geocoder = GeocodingService(
+        (
+            LocalGeocoderBackend()
+            if GEOCODER_BACKEND == "local"
+            else NominatimBackend(AddressParser.geolocatorRandomUserAgent(), TIMEOUT)
+        ),
+        rate=GEOCODE_RATE,
+        workers=GEOCODE_WORKERS,
+        geocode_cache=geocode_cache,
+    )
+    address_parser = AddressParser(
+        timeout=TIMEOUT,
+        gazetteer=gazetteer,
+        crawl_cache=crawl_cache,
+        geocoder=geocoder,
+    )
+    if PARSE_MODE == "processes":
+        address_parser = ParallelAddressParser(address_parser, PARSER_PROCESSES)
+
+    archive = CrawlArchive(ARCHIVE_PATH, append=args.resume) if args.record else None
+    controller = (
+        AdaptiveController(NUM_THREADS, max_limit=MAX_THREADS, initial_timeout=TIMEOUT)
+        if ADAPTIVE_CONCURRENCY
+        else None
+    )
+    page_store = None
+    crawler = None  # nothing is crawled when replaying
+    if not args.replay:
+        if PARSE_WHILE_CRAWLING and CRAWLER_MODE == "async":
+            # the async crawler fetches the pages of a website concurrently, there is nothing to stop early
+            print_error_and_exit(
+                'PARSE_WHILE_CRAWLING needs CRAWLER_MODE = "threads", the async crawler has no early stop'
+            )
 
-    for _, group in groups:
-        print(
-            f"{Fore.LIGHTGREEN_EX}[{group.index[0] + 1}-{group.index[-1] + 1}] {Style.RESET_ALL}Crawling websites {group.index[0] + 1}-{group.index[-1] + 1} out of {len(df)}"
-        )
+        with stage_imports("crawl"):
+            from utils.user_agent_provider import UserAgentProvider
+            from utils.page_store import PageStore
+
+            if CRAWLER_MODE == "async":
+                from utils.async_crawler import AsyncWebsiteCrawler
+            else:
+                from utils.crawler import WebsiteCrawler
+            if RUN_MODE == "pipeline":
+                from utils.pipeline import AddressPipeline
+
+        user_agent_provider = UserAgentProvider(user_agents)
+        if PAGE_STORE_PATH:
+            page_store = PageStore(PAGE_STORE_PATH, PAGE_STORE_TEXT_ONLY)
+
+        if CRAWLER_MODE == "async":
+            crawler = AsyncWebsiteCrawler(
+                TIMEOUT,
+                MAX_CONNECTIONS,
+                MAX_CONNECTIONS_PER_HOST,
+                page_store,
+                PAGE_BUDGET,
+                archive=archive,
+                host_registry=host_registry,
+                max_page_bytes=MAX_PAGE_BYTES,
+            )
+        else:
+            crawler = WebsiteCrawler(
+                TIMEOUT,
+                page_store,
+                crawl_cache,
+                PAGE_BUDGET,
+                archive=archive,
+                controller=controller,
+                host_registry=host_registry,
+                max_page_bytes=MAX_PAGE_BYTES,
+            )
 
-        current_index = group.index[0]
-        # Reset the index of group
-        group = group.reset_index(drop=True)
+    if metrics_path and METRICS_INTERVAL:
+        metrics.dump_every(metrics_path, METRICS_INTERVAL)
 
-        # Crawl the websites and get the links
-        responses = crawl_websites(group, CHUNK_SIZE, user_agent_provider)
+    startup = timer() - STARTED_AT - waited
+    metrics.observe("startup_seconds", startup)
+    print(
+        f"Startup: {Fore.GREEN}{startup:.2f}s{Style.RESET_ALL} (imports: {', '.join(f'{stage} {seconds:.2f}s' for stage, seconds in import_seconds.items())})"
+    )
 
-        # Parse the addresses from the links
-        for element in responses:
+    def crawl(chunks, total, checkpoint):
+        """
+        Crawls the domains, parses and geocodes their pages and commits the addresses to the checkpoint
+        :param chunks: iterable of lists of domains
+        :param total: int (number of domains, for the progress messages)
+        :param checkpoint: Checkpoint
+        """
+
+        if RUN_MODE == "pipeline":
+
+            def feed_domains():
+                for chunk in chunks:
+                    alive = dns_prefilter.filter(chunk) if dns_prefilter else chunk
+                    # the dead domains are finished without being crawled
+                    dead = set(chunk).difference(alive)
+                    pipeline.finish([domain for domain in chunk if domain in dead])
+                    yield from alive
+
+            # the geocode stage commits the addresses to the checkpoint every CHUNK_SIZE domains
+            pipeline = AddressPipeline(
+                crawler,
+                address_parser,
+                user_agent_provider,
+                num_crawlers=MAX_THREADS if crawler.controller else NUM_THREADS,
+                num_parsers=NUM_PARSERS,
+                num_geocoders=GEOCODE_WORKERS,
+                queue_size=QUEUE_SIZE,
+                checkpoint=checkpoint,
+                commit_size=CHUNK_SIZE,
+                parse_while_crawling=PARSE_WHILE_CRAWLING,
+            )
+            max_depths = pipeline.run(feed_domains())
             print(
-                f"{Fore.LIGHTGREEN_EX}[{current_index + responses.index(element) + 1}] {Style.RESET_ALL}Extracting address from {element[0].get('domain')}{Style.RESET_ALL}"
+                f"Maximum queue depths: {', '.join(f'{stage}={depth}' for stage, depth in max_depths.items())}"
             )
-
-            address_parser.parse_address(
-                element,
-                user_agent_provider.get_random_user_agent(),
-                list_of_addresses,
+        else:
+            crawl_in_chunks(
+                chunks,
+                total,
+                crawler,
+                address_parser,
+                user_agent_provider,
+                checkpoint,
+                dns_prefilter,
             )
 
-    # Write the addresses to a parquet file
-    io_handler.write_to_parquet(list_of_addresses)
+    if args.worker:
+        shard_queue = ShardQueue(args.worker, SHARD_LEASE)
+        total, number_of_addresses = work_on_shards(
+            shard_queue, worker_id, io_handler, host_registry, crawl
+        )
+        print(
+            f"Worker {worker_id}: {shard_queue.stats['completed']} shards done ({shard_queue.stats['expired_leases']} taken over from expired leases), run python3 main.py --merge {args.worker} once every worker is done"
+        )
+        shard_queue.close()
+    else:
+        checkpoint = Checkpoint(
+            io_handler, resume=args.resume, host_registry=host_registry
+        )
+        if checkpoint.done:
+            print(f"Resuming, skipping {len(checkpoint.done)} finished domains")
+
+        # Read the domain data from the parquet file
+        if args.replay:
+            # the websites are read back from the crawl archive, nothing is crawled
+            total = replay_in_chunks(
+                CrawlArchive.replay(args.replay), address_parser, checkpoint
+            )
+        elif STREAM_INPUT:
+            # one row group at a time, only the domain column
+            total = io_handler.count_parquet_rows(path) - len(checkpoint.done)
+            # the input domains are deduplicated, the batches can get smaller
+            chunks = (
+                group
+                for group in (
+                    list(host_registry.dedupe(batch, skip=checkpoint.is_done))
+                    for batch in io_handler.iter_parquet(path, "domain", CHUNK_SIZE)
+                )
+                if group
+            )
+            crawl(chunks, total, checkpoint)
+        else:
+            df = io_handler.parse_parquet(path, "domain")
+            input_domains = list(host_registry.dedupe(df, skip=checkpoint.is_done))
+            total = len(input_domains)
+            chunks = (
+                input_domains[index : index + CHUNK_SIZE]
+                for index in range(0, total, CHUNK_SIZE)
+            )  # Split the domains into chunks
+            crawl(chunks, total, checkpoint)
+
+    if PARSE_MODE == "processes":
+        address_parser.close()
+    if page_store:
+        page_store.close()
+    if archive:
+        archive.close()
+        print(f"Archived {archive.websites} websites to {ARCHIVE_PATH}")
+    geocoder.close()
+
+    if not args.worker:
+        # Merge the addresses of every chunk (and of the previous runs when resuming) into the parquet file
+        number_of_addresses = checkpoint.merge(output_path)
 
     # Calculate and print the elapsed time
     end = timer()
@@ -162,8 +733,43 @@ def main():
     print("\n-------------------------------------------------------")
     print(f"Time elapsed: {Fore.GREEN}{m} minutes and {s} seconds{Style.RESET_ALL}")
     print(
-        f"Extracted {Fore.GREEN}{len(list_of_addresses)}{Style.RESET_ALL} addresses from {Fore.YELLOW}{df.size}{Style.RESET_ALL} domains"
+        f"Extracted {Fore.GREEN}{number_of_addresses}{Style.RESET_ALL} addresses from {Fore.YELLOW}{total}{Style.RESET_ALL} domains"
+    )
+    print(
+        f"Geocoder: {Fore.GREEN}{geocoder.stats['requests']}{Style.RESET_ALL} requests, {Fore.GREEN}{geocoder.stats['coalesced']}{Style.RESET_ALL} coalesced lookups"
     )
+    print(
+        f"Input: {Fore.YELLOW}{host_registry.stats['duplicates']}{Style.RESET_ALL} duplicate domains skipped, {Fore.YELLOW}{host_registry.stats['aliases']}{Style.RESET_ALL} domains redirecting to a website already crawled (see the alias_of column)"
+    )
+    if geocode_cache:
+        print(
+            f"Geocode cache: {Fore.GREEN}{geocode_cache.stats['memory_hits']}{Style.RESET_ALL} memory hits, {Fore.GREEN}{geocode_cache.stats['disk_hits']}{Style.RESET_ALL} disk hits, {Fore.YELLOW}{geocode_cache.stats['misses']}{Style.RESET_ALL} misses"
+        )
+        geocode_cache.close()
+    if crawl_cache:
+        print(
+            f"Crawl cache: {Fore.GREEN}{crawl_cache.stats['not_modified'] + crawl_cache.stats['same_content']}{Style.RESET_ALL} unchanged pages, {Fore.YELLOW}{crawl_cache.stats['changed']}{Style.RESET_ALL} changed pages"
+        )
+        crawl_cache.close()
+    if dns_prefilter:
+        print(
+            f"DNS pre-resolution: {Fore.GREEN}{dns_prefilter.stats['alive']}{Style.RESET_ALL} alive domains, {Fore.YELLOW}{dns_prefilter.stats['dead'] + dns_prefilter.stats['cached_dead']}{Style.RESET_ALL} dead domains skipped ({dns_prefilter.stats['cached_dead']} from the cache), {dns_prefilter.stats['dns_errors']} crawled despite a DNS error, see output/failed_domains.log"
+        )
+        dns_prefilter.close()
+    if crawler and crawler.controller:
+        summary = crawler.controller.summary()
+        print(
+            f"Adaptive concurrency: {summary['initial_limit']} -> {Fore.GREEN}{summary['final_limit']}{Style.RESET_ALL} threads (lowest {summary['lowest_limit']}, highest {summary['highest_limit']}), {summary['increases']} increases, {summary['decreases']} decreases"
+        )
+        print(
+            f"Adaptive timeout: {TIMEOUT}s -> {Fore.GREEN}{summary['final_timeout']:.2f}s{Style.RESET_ALL}, {Fore.YELLOW}{summary['timeouts']}{Style.RESET_ALL} timeouts, {Fore.YELLOW}{summary['errors']}{Style.RESET_ALL} failed or throttled requests, {summary['retries']} retries ({summary['retry_successes']} succeeded)"
+        )
+        for seconds, old_limit, new_limit, reason in summary["decisions"][-10:]:
+            print(f"  {seconds:8.1f}s  {old_limit} -> {new_limit} threads ({reason})")
+    if metrics_path:
+        metrics.close()
+        metrics.dump(metrics_path)
+        print(f"Metrics written to {Fore.GREEN}{metrics_path}{Style.RESET_ALL}")
     print("-------------------------------------------------------")
 
 
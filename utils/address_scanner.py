@@ -0,0 +1,80 @@
+import re
+from collections import namedtuple
+
+# A street address or zip code found on the page
+# node is the index of the text node and start the position of the match inside it
+AddressCandidate = namedtuple(
+    "AddressCandidate", ["kind", "text", "node", "start", "paired"]
+)
+
+MAX_NODE_LENGTH = 100  # if the string is too long, it's probably not an address
+# number of text nodes a street and a zip code can be apart to be paired
+MAX_PAIR_DISTANCE = 3
+
+_digit_regex = re.compile(r"\d")
+
+
+class AddressScanner:
+    def __init__(self, street_regex, zip_code_regex, po_box_regex):
+        """
+        Finds the street addresses and zip codes of a page in a single pass over its visible text
+        Both patterns are matched separately on every node, a zip code can be inside a street match
+        (e.g. "Suite 12345 Main Business Center Drive") or start right after it
+        :param street_regex: re
+        :param zip_code_regex: re
+        :param po_box_regex: re
+        """
+
+        self.street_regex = street_regex
+        self.zip_code_regex = zip_code_regex
+        self.po_box_regex = po_box_regex
+
+    def scan(self, document):
+        """
+        Scans the text nodes of the document once with all the address patterns
+        Text inside <nav> elements and text without any digit (both patterns need one) is skipped
+        :param document: PageDocument
+        :return: list of AddressCandidate, best candidates first
+        """
+
+        streets = []
+        zip_codes = []
+
+        for node, text in enumerate(document.text_nodes):
+            if len(text) > MAX_NODE_LENGTH or node in document.navigation_nodes:
+                continue
+            if not _digit_regex.search(text):
+                continue
+
+            for match in self.street_regex.finditer(text):
+                location = self.po_box_regex.sub("", match.group(0))
+                streets.append((location, node, match.start()))
+            for match in self.zip_code_regex.finditer(text):
+                zip_codes.append((match.group(0), node, match.start()))
+
+        # A street and a zip code close to each other (e.g. both in the footer) are most likely the address
+        candidates = []
+        for kind, found, others in [
+            ("street", streets, zip_codes),
+            ("zip", zip_codes, streets),
+        ]:
+            for text, node, start in found:
+                paired = any(
+                    abs(node - other_node) <= MAX_PAIR_DISTANCE
+                    for _, other_node, _ in others
+                )
+                candidates.append(AddressCandidate(kind, text, node, start, paired))
+
+        candidates.sort(key=lambda c: (not c.paired, c.node, c.start))
+        return candidates
+
+    def best(self, candidates):
+        """
+        Picks the street address and the zip code to geocode from the ranked candidates
+        :param candidates: list of AddressCandidate (as returned by scan)
+        :return: tuple (street address or None, zip code or None)
+        """
+
+        street_address = next((c.text for c in candidates if c.kind == "street"), None)
+        zip_code = next((c.text for c in candidates if c.kind == "zip"), None)
+        return street_address, zip_code
@@ -0,0 +1,183 @@
+import uuid
+import zlib
+from datetime import datetime, timezone
+from threading import Lock
+
+# Headers that describe the body as it was sent, the archive stores it decoded
+_SKIPPED_HEADERS = {"content-encoding", "transfer-encoding", "content-length"}
+
+
+def make_record(domain, url, final_url, status, reason, headers, body):
+    """
+    Builds a WARC "response" record of a fetched page
+    :param domain: str (the website the page belongs to)
+    :param url: str (requested url)
+    :param final_url: str (url after the redirects)
+    :param status: int
+    :param reason: str (e.g. "OK")
+    :param headers: mapping of the response headers
+    :param body: bytes
+    :return: bytes
+    """
+
+    http_headers = "".join(
+        f"{name}: {value}\r\n"
+        for name, value in headers.items()
+        if name.lower() not in _SKIPPED_HEADERS
+    )
+    head = f"HTTP/1.1 {status} {reason or ''}\r\n{http_headers}Content-Length: {len(body)}\r\n\r\n"
+    payload = head.encode("utf-8", errors="replace") + body
+    warc_headers = (
+        "WARC/1.1\r\n"
+        "WARC-Type: response\r\n"
+        f"WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>\r\n"
+        f"WARC-Date: {datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}\r\n"
+        f"WARC-Target-URI: {final_url}\r\n"
+        f"X-Requested-URI: {url}\r\n"
+        f"X-Crawl-Domain: {domain}\r\n"
+        "Content-Type: application/http; msgtype=response\r\n"
+        f"Content-Length: {len(payload)}\r\n\r\n"
+    )
+    return warc_headers.encode("utf-8") + payload + b"\r\n\r\n"
+
+
+def _parse_headers(block):
+    headers = {}
+    for line in block.decode("utf-8", errors="replace").split("\r\n"):
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def parse_records(data):
+    """
+    Parses the WARC records of an archive member
+    :param data: bytes
+    :return: generator of dicts ("domain", "url", "final_url", "status", "headers", "body")
+    """
+
+    position = 0
+    while position < len(data):
+        end = data.index(b"\r\n\r\n", position)
+        warc_headers = _parse_headers(data[position:end])
+        start = end + 4
+        length = int(warc_headers["content-length"])
+        payload = data[start : start + length]
+        position = start + length + 4
+
+        header_end = payload.index(b"\r\n\r\n")
+        status_line, _, header_block = payload[:header_end].partition(b"\r\n")
+        yield {
+            "domain": warc_headers.get("x-crawl-domain"),
+            "url": warc_headers.get("x-requested-uri"),
+            "final_url": warc_headers.get("warc-target-uri"),
+            "status": int(status_line.split()[1]),
+            "headers": _parse_headers(header_block) if header_block else {},
+            "body": payload[header_end + 4 :],
+        }
+
+
+def decode_body(record):
+    """
+    Decodes the body of a record with the charset of its Content-Type (utf-8 if there is none)
+    :param record: dict (as returned by parse_records)
+    :return: str
+    """
+
+    content_type = record["headers"].get("content-type", "")
+    charset = "utf-8"
+    if "charset=" in content_type:
+        charset = content_type.split("charset=")[-1].split(";")[0].strip(" \"'")
+
+    try:
+        return record["body"].decode(charset, errors="replace")
+    except LookupError:
+        return record["body"].decode("utf-8", errors="replace")
+
+
+class CrawlArchive:
+    def __init__(self, path="output/crawl.warc.gz", append=False, level=6):
+        """
+        WARC style archive of the crawled pages (requested url, final url, headers and body)
+        The pages of a website are written together, as one gzip member, so a replay reads one website at a time
+        :param path: str
+        :param append: bool (keep the websites already in the archive, e.g. when resuming)
+        :param level: int (gzip compression level)
+        """
+
+        self.path = path
+        self.level = level
+        self.lock = Lock()
+        self.file = open(path, "ab" if append else "wb")
+        self.websites = 0
+
+    def write_website(self, records):
+        """
+        Appends the pages of a website
+        :param records: list of bytes (as returned by make_record)
+        """
+
+        if not records:
+            return
+
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)  # gzip format
+        data = compressor.compress(b"".join(records)) + compressor.flush()
+
+        with self.lock:
+            self.file.write(data)
+            self.file.flush()
+            self.websites += 1
+
+    def close(self):
+        """
+        Closes the archive
+        """
+
+        with self.lock:
+            self.file.close()
+
+    @staticmethod
+    def iter_members(path, chunk_size=1 << 20):
+        """
+        Reads the gzip members of an archive one by one
+        A member cut short by a crash is ignored
+        :param path: str
+        :param chunk_size: int
+        :return: generator of bytes
+        """
+
+        with open(path, "rb") as f:
+            decompressor = zlib.decompressobj(31)
+            parts = []
+            buffer = b""
+            while True:
+                if not buffer:
+                    buffer = f.read(chunk_size)
+                    if not buffer:
+                        break
+
+                parts.append(decompressor.decompress(buffer))
+                buffer = b""
+                if decompressor.eof:
+                    yield b"".join(parts)
+                    buffer = decompressor.unused_data
+                    decompressor = zlib.decompressobj(31)
+                    parts = []
+
+    @staticmethod
+    def replay(path):
+        """
+        Reads the archived websites back as crawler records, without any network access
+        :param path: str
+        :return: generator of lists (the records of one website, as made by WebsiteCrawler.make_record)
+        """
+
+        for member in CrawlArchive.iter_members(path):
+            yield [
+                {
+                    "domain": record["domain"],
+                    "url": record["url"],
+                    "response": decode_body(record),
+                }
+                for record in parse_records(member)
+            ]
@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import time
+import aiohttp
+
+from utils.crawler import (
+    WebsiteCrawler,
+    BodyReader,
+    STREAM_CHUNK_SIZE,
+    is_html,
+    record_download,
+)
+from utils.document import PageDocument
+from utils.frontier import LinkFrontier
+from utils.metrics import metrics
+from utils.archive import make_record as make_archive_record
+
+
+def _start_timer(name):
+    async def on_start(session, context, params):
+        setattr(context, name, time.perf_counter())
+
+    return on_start
+
+
+def _stop_timer(name, metric):
+    async def on_end(session, context, params):
+        start = getattr(context, name, None)
+        if start is not None:
+            metrics.observe(metric, time.perf_counter() - start)
+
+    return on_end
+
+
+def make_trace_config():
+    """
+    Creates the aiohttp trace config that records the DNS, connect and first byte times of every request
+    :return: aiohttp.TraceConfig
+    """
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_dns_resolvehost_start.append(_start_timer("dns_start"))
+    trace_config.on_dns_resolvehost_end.append(_stop_timer("dns_start", "dns_seconds"))
+    trace_config.on_connection_create_start.append(_start_timer("connect_start"))
+    trace_config.on_connection_create_end.append(
+        _stop_timer("connect_start", "connect_seconds")
+    )
+    trace_config.on_request_start.append(_start_timer("request_start"))
+    trace_config.on_request_end.append(
+        _stop_timer("request_start", "fetch_first_byte_seconds")
+    )
+    return trace_config
+
+
+class AsyncWebsiteCrawler(WebsiteCrawler):
+    def __init__(
+        self,
+        timeout,
+        max_connections=100,
+        max_connections_per_host=4,
+        page_store=None,
+        page_budget=5,
+        scheme="https",
+        proxy=None,
+        archive=None,
+        host_registry=None,
+        max_page_bytes=None,
+    ):
+        super().__init__(
+            timeout,
+            page_store,
+            page_budget=page_budget,
+            scheme=scheme,
+            proxy=proxy,
+            archive=archive,
+            host_registry=host_registry,
+            max_page_bytes=max_page_bytes,
+        )
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+
+    async def fetch_async(self, session, url, headers):
+        """
+        Fetches a page using the shared session (the connection is kept alive and reused)
+        :param session: aiohttp.ClientSession
+        :param url: str
+        :param headers: dict
+        :return: tuple (status code, final url after redirects, html of the page,
+                        (reason, headers, body bytes) for the crawl archive)
+        """
+
+        try:
+            async with session.get(
+                url, headers=headers, allow_redirects=True, ssl=False, proxy=self.proxy
+            ) as response:
+                start = time.perf_counter()
+                if self.max_page_bytes is None:
+                    body = await response.read()
+                    text = await response.text(errors="replace")
+                else:
+                    body = await self.read_body_async(response)
+                    try:
+                        text = body.decode(
+                            response.charset or "utf-8", errors="replace"
+                        )
+                    except LookupError:
+                        text = body.decode("utf-8", errors="replace")
+                metrics.observe("fetch_download_seconds", time.perf_counter() - start)
+                metrics.observe("response_bytes", len(body))
+                metrics.increment("responses_total", status=str(response.status))
+
+                return (
+                    response.status,
+                    str(response.url),
+                    text,
+                    (response.reason, response.headers, body),
+                )
+        except Exception:
+            metrics.increment("errors_total", stage="fetch")
+            raise
+
+    async def read_body_async(self, response):
+        """
+        Reads the body of a response, at most max_page_bytes of it and nothing if it is not html
+        (see WebsiteCrawler.read_body)
+        :param response: aiohttp.ClientResponse
+        :return: bytes
+        """
+
+        reader = BodyReader(self.max_page_bytes)
+        if not is_html(response.headers):
+            result = "not_html"
+        else:
+            result = "complete"
+            async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                if not reader.feed(chunk):
+                    result = reader.stopped
+                    break
+
+        if result != "complete" and not response.content.at_eof():
+            # the rest of the body is not read, the connection cannot be reused
+            response.close()
+        record_download(response.headers, reader.size, result)
+        return reader.body() if result != "not_html" else b""
+
+    async def crawl_website_async(self, session, semaphore, domain, user_agent):
+        """
+        Crawls the website and its "about" / "contact" pages
+        The best subpages (up to the page budget) are fetched concurrently, not one after another
+        :param session: aiohttp.ClientSession
+        :param semaphore: asyncio.Semaphore (limits the number of domains in flight)
+        :param domain: str
+        :param user_agent: str
+        :return: list (same format as WebsiteCrawler.crawl_website)
+        """
+
+        headers = {"User-Agent": user_agent}
+        responses = []
+        # (url, final url, status, raw) of the fetched pages, for the crawl archive
+        archived = []
+
+        async with semaphore:
+            print(f"Crawling website: {domain}")
+            metrics.increment("domains_total", stage="crawl")
+            start = time.perf_counter()
+
+            url = f"{self.scheme}://{domain}"
+            requested = domain
+            try:
+                status, final_url, response, raw = await self.fetch_async(
+                    session, url, headers
+                )
+            except Exception as e:
+                logging.error(f"Error occurred while crawling {domain}. Error: {e}")
+                return responses
+
+            if not response:  # the main page is not html
+                return responses
+
+            # if the main page redirects to another page, we change the domain to the redirected page's domain
+            if domain not in final_url:
+                domain = final_url.split("/")[2]
+
+            # another input domain already landed on the same website, it is not crawled twice
+            if self.host_registry and not self.host_registry.claim(
+                requested, final_url
+            ):
+                return responses
+
+            try:
+                with metrics.timer("parse_seconds"):
+                    document = PageDocument(response)
+                frontier = LinkFrontier(domain, self.page_budget)
+                frontier.add(self.find_links(domain, response, document))
+                new_links = list(frontier)
+            except Exception as e:
+                metrics.increment("errors_total", stage="crawl")
+                logging.error(f"Error occurred while parsing {domain}. Error: {e}")
+                document = None
+                new_links = []
+
+            if self.archive:
+                archived.append((url, final_url, status, raw))
+            responses.append(self.make_record(domain, response, document, url))
+
+            results = await asyncio.gather(
+                *[self.fetch_async(session, link, headers) for link in new_links],
+                return_exceptions=True,
+            )
+
+            for link, result in zip(new_links, results):
+                if isinstance(result, Exception):
+                    continue
+
+                status, final_url, response, raw = result
+                if status != 200 or not response:  # empty when the page is not html
+                    continue
+
+                if self.archive:
+                    archived.append((link, final_url, status, raw))
+                responses.append(self.make_record(domain, response, url=link))
+
+            if self.archive:
+                self.archive.write_website(
+                    [
+                        make_archive_record(domain, page_url, final_url, status, *raw)
+                        for page_url, final_url, status, raw in archived
+                    ]
+                )
+
+            metrics.observe("crawl_domain_seconds", time.perf_counter() - start)
+
+        return responses
+
+    async def crawl_websites_async(self, domains, user_agent_provider):
+        """
+        Crawls the websites using a single pool of keep-alive connections
+        :param domains: iterable of str
+        :param user_agent_provider: UserAgentProvider
+        :return: list of lists (one list of responses per crawled domain)
+        """
+
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            limit_per_host=self.max_connections_per_host,
+            ttl_dns_cache=300,
+            ssl=False,
+        )
+        # no total timeout: the time spent waiting for a free connection of the pool is not the server's fault
+        timeout = aiohttp.ClientTimeout(
+            total=None, sock_connect=self.timeout, sock_read=self.timeout
+        )
+        # every domain in flight can use 1 + page_budget connections, so fewer domains than connections
+        # are crawled at once and their requests do not starve each other of connections
+        semaphore = asyncio.Semaphore(
+            max(1, self.max_connections // (1 + self.page_budget))
+        )
+
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=timeout, trace_configs=[make_trace_config()]
+        ) as session:
+            results = await asyncio.gather(
+                *[
+                    self.crawl_website_async(
+                        session,
+                        semaphore,
+                        domain,
+                        user_agent_provider.get_random_user_agent(),
+                    )
+                    for domain in domains
+                ]
+            )
+
+        return [responses for responses in results if responses]
+
+    def crawl_websites(self, domains, user_agent_provider):
+        """
+        Crawls the websites (blocking wrapper around crawl_websites_async)
+        :param domains: iterable of str
+        :param user_agent_provider: UserAgentProvider
+        :return: list of lists (one list of responses per crawled domain)
+        """
+
+        return asyncio.run(self.crawl_websites_async(domains, user_agent_provider))
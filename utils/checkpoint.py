@@ -0,0 +1,101 @@
+import os
+import shutil
+from threading import Lock
+
+
+class Checkpoint:
+    def __init__(
+        self,
+        io_handler,
+        parts_path="output/addresses.parts",
+        manifest_path="output/checkpoint.manifest",
+        resume=False,
+        host_registry=None,
+    ):
+        """
+        Writes the results of every chunk as soon as it is done, so a crashed run can be resumed
+        The addresses of every chunk are written to their own parquet file and the finished domains to a manifest file
+        :param io_handler: IOHandler
+        :param parts_path: str (directory of the parquet files, one per chunk)
+        :param manifest_path: str (text file with one finished domain per line)
+        :param resume: bool (keep the results of the previous run instead of starting over)
+        :param host_registry: HostRegistry (adds the rows of the aliases) or None
+        """
+
+        self.io_handler = io_handler
+        self.host_registry = host_registry
+        self.parts_path = parts_path
+        self.manifest_path = manifest_path
+        self.lock = Lock()
+        self.done = set()
+
+        if resume and os.path.exists(manifest_path):
+            with open(manifest_path, "r") as f:
+                self.done = {line.strip() for line in f if line.strip()}
+        else:
+            shutil.rmtree(parts_path, ignore_errors=True)
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+
+        os.makedirs(parts_path, exist_ok=True)
+        # temporary files of a chunk that was being written when the previous run crashed
+        for name in os.listdir(parts_path):
+            if name.endswith(".tmp"):
+                os.remove(os.path.join(parts_path, name))
+        self.next_part = len(self.parts())
+
+    def parts(self):
+        """
+        Returns the parquet files of the finished chunks, in the order they were written
+        :return: list of str
+        """
+
+        return [
+            os.path.join(self.parts_path, name)
+            for name in sorted(os.listdir(self.parts_path))
+            if name.startswith("part-") and name.endswith(".parquet")
+        ]
+
+    def is_done(self, domain):
+        """
+        Checks if the domain was already processed by a previous run
+        :param domain: str
+        :return: bool
+        """
+
+        return domain in self.done
+
+    def commit_chunk(self, domains, addresses):
+        """
+        Saves the results of a finished chunk, it can be called from several threads
+        The parquet file of the chunk is on disk before the manifest lists its domains: a crash in between
+        only redoes the chunk, and the duplicated rows are dropped by merge
+        :param domains: list of str (the input domains of the chunk)
+        :param addresses: list (the addresses found in the chunk)
+        """
+
+        with self.lock:
+            if self.host_registry:
+                addresses = self.host_registry.add_aliases(domains, addresses)
+
+            part_path = os.path.join(
+                self.parts_path, f"part-{self.next_part:06d}.parquet"
+            )
+            if self.io_handler.write_part(addresses, part_path):
+                self.next_part += 1
+
+            with open(self.manifest_path, "a") as f:
+                f.write("".join(f"{domain}\n" for domain in domains))
+                f.flush()
+                os.fsync(f.fileno())
+
+            self.done.update(domains)
+
+    def merge(self, file_path):
+        """
+        Merges the parquet files of the chunks into the final parquet file
+        :param file_path: str
+        :return: int (number of addresses written)
+        """
+
+        return self.io_handler.concat_parquet(self.parts(), file_path)
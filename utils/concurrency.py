@@ -0,0 +1,203 @@
+import statistics
+import time
+from collections import deque
+from threading import Condition
+
+
+class AdaptiveController:
+    def __init__(
+        self,
+        initial_limit=40,
+        min_limit=4,
+        max_limit=200,
+        increase=4,
+        decrease=0.75,
+        window=50,
+        timeout_threshold=0.1,
+        latency_tolerance=2.0,
+        min_latency=0.1,
+        initial_timeout=2,
+        min_timeout=1,
+        max_timeout=10,
+        timeout_percentile=0.95,
+        timeout_factor=2.0,
+        retry_factor=2.0,
+    ):
+        """
+        Adapts the crawl concurrency and the request timeouts to what the network can take
+        Concurrency is AIMD (additive increase, multiplicative decrease): after every window of requests,
+        the limit grows by increase, unless too many requests timed out or failed (connection errors, 429 / 503)
+        or the median latency went well above
+        the best median seen so far, in which case it is multiplied by decrease
+        The timeout of a request is timeout_factor times the timeout_percentile of the recent latencies,
+        a request that timed out is retried once with retry_factor times that timeout
+        Used as the semaphore of the crawler threads (acquire / release)
+        :param initial_limit: int (concurrent crawls at the start)
+        :param min_limit: int
+        :param max_limit: int
+        :param increase: int (added to the limit after a healthy window)
+        :param decrease: float (the limit is multiplied by it after an unhealthy window)
+        :param window: int (number of requests between two decisions)
+        :param timeout_threshold: float (share of timed out or failed requests that makes a window unhealthy)
+        :param latency_tolerance: float (median latency, relative to the best median, that makes a window unhealthy)
+        :param min_latency: float (seconds, a median under it is always healthy)
+        :param initial_timeout: float (seconds, used until enough latencies were observed)
+        :param min_timeout: float
+        :param max_timeout: float
+        :param timeout_percentile: float
+        :param timeout_factor: float
+        :param retry_factor: float
+        """
+
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.window = window
+        self.timeout_threshold = timeout_threshold
+        self.latency_tolerance = latency_tolerance
+        self.min_latency = min_latency
+        self.initial_timeout = initial_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_percentile = timeout_percentile
+        self.timeout_factor = timeout_factor
+        self.retry_factor = retry_factor
+
+        self.condition = Condition()
+        self.in_flight = 0
+        self.samples = []  # (latency, timed out or failed) of the current window
+        # latencies of the recent successful requests
+        self.latencies = deque(maxlen=1000)
+        self.best_median = None
+        self.current_timeout = initial_timeout
+        self.started_at = time.monotonic()
+
+        self.decisions = []  # (seconds since the start, old limit, new limit, reason)
+        self.stats = {
+            "initial_limit": initial_limit,
+            "lowest_limit": initial_limit,
+            "highest_limit": initial_limit,
+            "increases": 0,
+            "decreases": 0,
+            "timeouts": 0,
+            "errors": 0,
+            "retries": 0,
+            "retry_successes": 0,
+        }
+
+    def acquire(self):
+        """
+        Blocks until the number of crawls in flight is under the current limit
+        """
+
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        """
+        Ends a crawl started with acquire
+        """
+
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def timeout(self):
+        """
+        Returns the timeout of the next request
+        :return: float (seconds)
+        """
+
+        return self.current_timeout
+
+    def retry_timeout(self):
+        """
+        Returns the timeout of the retry of a request that timed out
+        :return: float (seconds)
+        """
+
+        return min(self.current_timeout * self.retry_factor, self.max_timeout)
+
+    def record(self, latency, timed_out=False, retry=False, error=False):
+        """
+        Records the outcome of a request
+        :param latency: float (seconds)
+        :param timed_out: bool
+        :param retry: bool (the request was the retry of a request that timed out)
+        :param error: bool (the request failed without timing out, or the server answered 429 / 503)
+        """
+
+        with self.condition:
+            if retry:
+                self.stats["retries"] += 1
+                if not timed_out and not error:
+                    self.stats["retry_successes"] += 1
+            if timed_out:
+                self.stats["timeouts"] += 1
+            elif error:
+                self.stats["errors"] += 1
+            else:
+                self.latencies.append(latency)
+
+            self.samples.append((latency, timed_out or error))
+            if len(self.samples) >= self.window:
+                self._adjust()
+                self.samples = []
+
+    def _adjust(self):
+        latencies = sorted(
+            latency for latency, unhealthy in self.samples if not unhealthy
+        )
+        unhealthy_rate = 1 - len(latencies) / len(self.samples)
+        median = statistics.median(latencies) if latencies else None
+        if median is not None:
+            self.best_median = min(self.best_median or median, median)
+
+        if unhealthy_rate > self.timeout_threshold:
+            new_limit = self.limit * self.decrease
+            reason = f"{unhealthy_rate:.0%} of the requests timed out or failed"
+        elif median is not None and median > max(
+            self.best_median * self.latency_tolerance, self.min_latency
+        ):
+            new_limit = self.limit * self.decrease
+            reason = f"median latency {median:.2f}s, best {self.best_median:.2f}s"
+        else:
+            new_limit = self.limit + self.increase
+            reason = "healthy window"
+
+        new_limit = max(self.min_limit, min(self.max_limit, int(new_limit)))
+        if new_limit != self.limit:
+            self.stats["increases" if new_limit > self.limit else "decreases"] += 1
+            self.decisions.append(
+                (time.monotonic() - self.started_at, self.limit, new_limit, reason)
+            )
+            self.limit = new_limit
+            self.stats["lowest_limit"] = min(self.stats["lowest_limit"], new_limit)
+            self.stats["highest_limit"] = max(self.stats["highest_limit"], new_limit)
+            self.condition.notify_all()
+
+        if len(self.latencies) >= self.window:
+            recent = sorted(self.latencies)
+            percentile = recent[int(self.timeout_percentile * (len(recent) - 1))]
+            self.current_timeout = max(
+                self.min_timeout,
+                min(self.max_timeout, percentile * self.timeout_factor),
+            )
+
+    def summary(self):
+        """
+        Summarizes the decisions of the controller
+        :return: dict
+        """
+
+        with self.condition:
+            return {
+                **self.stats,
+                "final_limit": self.limit,
+                "final_timeout": self.current_timeout,
+                "decisions": list(self.decisions),
+            }
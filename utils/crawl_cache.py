@@ -0,0 +1,145 @@
+import hashlib
+import json
+import sqlite3
+from threading import Lock
+
+
+class CrawlCache:
+    def __init__(self, path="output/crawl_cache.sqlite"):
+        """
+        Persistent cache of the crawled pages, so that recurring crawls skip the pages that did not change
+        For every url it keeps the ETag / Last-Modified validators, a hash of the content and the links found on it,
+        and for every domain the address extracted by the previous crawl (with the url of the page it was found on)
+        :param path: str (path of the SQLite file)
+        """
+
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, content_hash TEXT, links TEXT)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS addresses (domain TEXT PRIMARY KEY, url TEXT, address TEXT)"
+        )
+        self.connection.commit()
+
+        self.stats = {"not_modified": 0, "same_content": 0, "changed": 0}
+
+    def _get_page(self, url):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT etag, last_modified, content_hash, links FROM pages WHERE url = ?",
+                (url,),
+            ).fetchone()
+
+    def conditional_headers(self, url):
+        """
+        Returns the headers that make the request for the url conditional
+        :param url: str
+        :return: dict
+        """
+
+        row = self._get_page(url)
+        headers = {}
+        if row and row[0]:
+            headers["If-None-Match"] = row[0]
+        if row and row[1]:
+            headers["If-Modified-Since"] = row[1]
+        return headers
+
+    def revalidate(self, url, response):
+        """
+        Checks if the page changed since the previous crawl and stores its new validators and content hash
+        :param url: str (the requested url)
+        :param response: requests.Response
+        :return: bool (True if the page did not change)
+        """
+
+        if response.status_code == 304:
+            with self.lock:
+                self.stats["not_modified"] += 1
+            return True
+
+        if response.status_code != 200:
+            return False
+
+        content_hash = hashlib.sha1(response.content).hexdigest()
+        row = self._get_page(url)
+
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO pages (url, etag, last_modified, content_hash) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(url) DO UPDATE SET etag = excluded.etag, last_modified = excluded.last_modified, content_hash = excluded.content_hash",
+                (
+                    url,
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                    content_hash,
+                ),
+            )
+            self.connection.commit()
+
+            unchanged = bool(row) and row[2] == content_hash
+            self.stats["same_content" if unchanged else "changed"] += 1
+
+        return unchanged
+
+    def get_links(self, url):
+        """
+        Returns the about / contact links found on the page by the previous crawl
+        :param url: str
+        :return: list
+        """
+
+        row = self._get_page(url)
+        return json.loads(row[3]) if row and row[3] else []
+
+    def set_links(self, url, links):
+        """
+        Stores the about / contact links found on the page
+        :param url: str
+        :param links: list
+        """
+
+        with self.lock:
+            self.connection.execute(
+                "UPDATE pages SET links = ? WHERE url = ?", (json.dumps(links), url)
+            )
+            self.connection.commit()
+
+    def get_address(self, domain):
+        """
+        Returns the address extracted for the domain by the previous crawl
+        :param domain: str
+        :return: tuple (url of the page the address was found on, address) or None
+        """
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT url, address FROM addresses WHERE domain = ?", (domain,)
+            ).fetchone()
+
+        return (row[0], json.loads(row[1])) if row else None
+
+    def set_address(self, domain, url, address):
+        """
+        Stores the address extracted for the domain
+        :param domain: str
+        :param url: str (url of the page the address was found on)
+        :param address: dict
+        """
+
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO addresses (domain, url, address) VALUES (?, ?, ?)",
+                (domain, url, json.dumps(address)),
+            )
+            self.connection.commit()
+
+    def close(self):
+        """
+        Closes the SQLite connection
+        """
+
+        with self.lock:
+            self.connection.close()
@@ -1,13 +1,120 @@
+import logging
+import time
 import requests
-from bs4 import BeautifulSoup as bs
 import urllib3
 from colorama import init as colorama_init
 from colorama import Fore, Style
 
+from utils.document import PageDocument
+from utils.frontier import LinkFrontier
+from utils.metrics import metrics
+from utils.archive import make_record as make_archive_record
+
+# Pages with another Content-Type (PDF brochures, images, videos...) are not downloaded
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+STREAM_CHUNK_SIZE = 64 * 1024
+_HTML_END = b"</html>"
+# Answers of an overloaded or rate limiting server, counted as failures by the adaptive controller
+THROTTLED_STATUSES = {429, 503}
+
+
+def is_html(headers):
+    """
+    Checks the Content-Type of a response, a response without one is assumed to be html
+    :param headers: mapping of the response headers
+    :return: bool
+    """
+
+    content_type = headers.get("Content-Type")
+    return not content_type or any(
+        html_type in content_type.lower() for html_type in HTML_CONTENT_TYPES
+    )
+
+
+class BodyReader:
+    def __init__(self, max_bytes):
+        """
+        Collects the chunks of a streamed body until "</html>" is seen or max_bytes were read
+        :param max_bytes: int
+        """
+
+        self.max_bytes = max_bytes
+        self.parts = []
+        self.size = 0
+        # end of the previous chunk, "</html>" can be split between two chunks
+        self.tail = b""
+        self.stopped = None  # "end_of_html" or "byte_cap" once enough was read
+
+    def feed(self, chunk):
+        """
+        Adds a chunk of the body
+        :param chunk: bytes
+        :return: bool (False once the rest of the body is not needed)
+        """
+
+        self.parts.append(chunk)
+        self.size += len(chunk)
+        window = (self.tail + chunk).lower()
+        if _HTML_END in window:
+            self.stopped = "end_of_html"
+        elif self.size >= self.max_bytes:
+            self.stopped = "byte_cap"
+        self.tail = window[1 - len(_HTML_END) :]
+        return self.stopped is None
+
+    def body(self):
+        """
+        Returns the body read so far, cut at max_bytes
+        :return: bytes
+        """
+
+        return b"".join(self.parts)[: self.max_bytes]
+
+
+def record_download(headers, size, result):
+    """
+    Counts a streamed download and the bytes it did not read
+    The saved bytes are only known when the server sent an uncompressed Content-Length
+    :param headers: mapping of the response headers
+    :param size: int (bytes read)
+    :param result: str ("complete", "end_of_html", "byte_cap" or "not_html")
+    """
+
+    metrics.increment("downloads_total", result=result)
+    length = headers.get("Content-Length")
+    if result != "complete" and length and length.isdigit():
+        if not headers.get("Content-Encoding"):
+            metrics.increment("saved_bytes_total", max(int(length) - size, 0))
+
 
 class WebsiteCrawler:
-    def __init__(self, timeout):
+    def __init__(
+        self,
+        timeout,
+        page_store=None,
+        crawl_cache=None,
+        page_budget=5,
+        scheme="https",
+        proxy=None,
+        archive=None,
+        controller=None,
+        host_registry=None,
+        max_page_bytes=None,
+    ):
         self.timeout = timeout
+        self.scheme = scheme  # "http" to crawl the local benchmark fixtures
+        # e.g. "http://127.0.0.1:8080", every request goes through it
+        self.proxy = proxy
+        self.page_budget = (
+            page_budget  # maximum number of "about" / "contact" pages per website
+        )
+        self.page_store = page_store  # PageStore or None
+        self.crawl_cache = crawl_cache  # CrawlCache or None
+        self.archive = archive  # CrawlArchive or None
+        self.controller = controller  # AdaptiveController (adaptive timeouts) or None
+        self.host_registry = host_registry  # HostRegistry or None
+        # bodies are streamed and cut at this size, non html pages are skipped, None reads everything
+        self.max_page_bytes = max_page_bytes
 
     # def get_random_user_agent(self):
     #     """
@@ -16,88 +123,343 @@ class WebsiteCrawler:
     #     """
     #     return self.user_agents[np.random.randint(0, len(self.user_agents))]
 
-    def crawl_website(self, domain, user_agent, output_arr):
+    def get(self, url, headers):
+        """
+        Sends the request
+        With a controller, the timeout comes from the recent latencies and a request that timed out is retried once,
+        with a longer timeout; failed and throttled (429 / 503) requests are reported to it as unhealthy
+        :param url: str
+        :param headers: dict
+        :return: requests.Response
         """
-        Crawls the website and returns a list of links found on the website
-        We are specifically looking for links that contain "about" or "contact" in them
+
+        timeout = self.controller.timeout() if self.controller else self.timeout
+        proxies = {"http": self.proxy, "https": self.proxy} if self.proxy else None
+
+        def send(timeout):
+            return requests.get(
+                url,
+                timeout=timeout,
+                headers=headers,
+                allow_redirects=True,
+                verify=False,
+                proxies=proxies,
+                stream=self.max_page_bytes is not None,
+            )
+
+        if not self.controller:
+            return send(timeout)
+
+        start = time.perf_counter()
+        try:
+            response = send(timeout)
+        except requests.Timeout:
+            self.controller.record(time.perf_counter() - start, timed_out=True)
+        except requests.RequestException:
+            # connection reset or refused, TLS errors: the network is not healthy either
+            self.controller.record(time.perf_counter() - start, error=True)
+            raise
+        else:
+            self.controller.record(
+                time.perf_counter() - start,
+                error=response.status_code in THROTTLED_STATUSES,
+            )
+            return response
+
+        timeout = self.controller.retry_timeout()
+        start = time.perf_counter()
+        try:
+            response = send(timeout)
+        except requests.Timeout:
+            self.controller.record(
+                time.perf_counter() - start, timed_out=True, retry=True
+            )
+            raise
+        except requests.RequestException:
+            self.controller.record(time.perf_counter() - start, retry=True, error=True)
+            raise
+        self.controller.record(
+            time.perf_counter() - start,
+            retry=True,
+            error=response.status_code in THROTTLED_STATUSES,
+        )
+        return response
+
+    def read_body(self, response):
+        """
+        Reads the body of a streamed response, at most max_page_bytes of it and nothing if it is not html
+        The connection is closed as soon as enough was read
+        :param response: requests.Response (sent with stream=True)
+        """
+
+        reader = BodyReader(self.max_page_bytes)
+        try:
+            if not is_html(response.headers):
+                result = "not_html"
+            else:
+                result = "complete"
+                for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                    if not reader.feed(chunk):
+                        result = reader.stopped
+                        break
+        finally:
+            response.close()
+
+        # response.content and response.text now return the part that was read
+        response._content = reader.body() if result != "not_html" else b""
+        response._content_consumed = True
+        record_download(response.headers, reader.size, result)
+
+    def fetch(self, url, headers):
+        """
+        Fetches a page
+        If the crawl cache knows the page, the request is conditional (the server can answer 304 Not Modified)
+        With max_page_bytes, the body is streamed (see read_body), a page that is not html has an empty body
+        The time to the first byte (DNS and connect included), the download time and the size are recorded
+        :param url: str
+        :param headers: dict
+        :return: requests.Response
+        """
+
+        if self.crawl_cache:
+            headers = {**headers, **self.crawl_cache.conditional_headers(url)}
+
+        start = time.perf_counter()
+        try:
+            response = self.get(url, headers)
+            if self.max_page_bytes is not None:
+                self.read_body(response)
+        except Exception:
+            metrics.increment("errors_total", stage="fetch")
+            raise
+        total = time.perf_counter() - start
+
+        first_byte = response.elapsed.total_seconds()
+        metrics.observe("fetch_first_byte_seconds", first_byte)
+        metrics.observe("fetch_download_seconds", max(total - first_byte, 0))
+        metrics.observe("response_bytes", len(response.content))
+        metrics.increment("responses_total", status=str(response.status_code))
+
+        return response
+
+    def make_record(self, domain, response, document=None, url=None):
+        """
+        Creates the record of a crawled page
+        With a page store, the page is spooled to disk and the record only holds a PageHandle
         :param domain: str
-        :return: list
+        :param response: str (html of the page)
+        :param document: PageDocument
+        :param url: str (url of the page)
+        :return: dict
         """
 
+        if self.page_store:
+            return {
+                "domain": domain,
+                "url": url,
+                "response": self.page_store.put(response, document),
+            }
+
+        return {
+            "domain": domain,
+            "url": url,
+            "response": response,
+            "document": document,
+        }
+
+    def make_cached_record(self, domain, url, cached):
+        """
+        Creates the record of an unchanged page, holding the address extracted from it by a previous crawl
+        :param domain: str
+        :param url: str
+        :param cached: tuple (url of the page the address was found on, address)
+        :return: dict
+        """
+
+        return {"domain": domain, "url": url, "cached_address": cached[1]}
+
+    def archive_page(self, archived, domain, url, response):
+        """
+        Keeps the fetched page for the crawl archive (if there is one)
+        :param archived: list (the archive records of the website)
+        :param domain: str
+        :param url: str (the requested url)
+        :param response: requests.Response
+        """
+
+        if self.archive:
+            archived.append(
+                make_archive_record(
+                    domain,
+                    url,
+                    response.url,
+                    response.status_code,
+                    response.reason,
+                    response.headers,
+                    response.content,
+                )
+            )
+
+    def find_links(self, domain, response, document):
+        """
+        Finds the links on the page that contain "about" or "contact" in them
+        :param domain: str
+        :param response: str (html of the page)
+        :param document: PageDocument (the parsed page)
+        :return: list (without duplicates)
+        """
+
+        new_links = []
+
+        if (
+            not "404" in response
+            or not "error" in response
+            or not "not found" in response
+        ):
+            if document.links:
+                for href in document.links:
+                    if href:
+                        if (
+                            "about" in href
+                            or "contact" in href
+                            and not "mailto" in href
+                        ):
+                            if domain in href:
+                                new_links.append(href)
+                            else:
+                                if not "http" in href:
+                                    if "/" == href[0]:
+                                        new_links.append(
+                                            f"{self.scheme}://{domain}{href}"
+                                        )
+                                    else:
+                                        new_links.append(
+                                            f"{self.scheme}://{domain}/{href}"
+                                        )
+                                else:
+                                    new_links.append(href)
+
+        return sorted(set(new_links))  # remove duplicates, in a stable order
+
+    def iter_pages(self, domain, user_agent):
+        """
+        Crawls the website page by page: first the main page, then its "about" / "contact" pages, best ones first
+        A page is only fetched when the next record is asked for, so the caller can stop as soon as it has an address
+        With an archive, the fetched pages of the website are written to it once the crawl of the website is over
+        :param domain: str
+        :param user_agent: str
+        :return: generator of records
+        """
+
+        archived = []
+        try:
+            yield from self._iter_pages(domain, user_agent, archived)
+        finally:
+            if self.archive:
+                self.archive.write_website(archived)
+
+    def _iter_pages(self, domain, user_agent, archived):
         urllib3.disable_warnings()
 
         headers = {"User-Agent": user_agent}
         print(f"Crawling website: {domain}")
         new_links = []
-        responses = []
+        main_page = None
+
+        url = f"{self.scheme}://{domain}"
+        requested = domain
+        cached = None  # (url of the page the address was found on, address) from a previous crawl
 
         try:
-            response = requests.get(
-                f"https://{domain}",
-                timeout=self.timeout,
-                headers=headers,
-                allow_redirects=True,
-                verify=False,
-            )
+            response = self.fetch(url, headers)
 
             # if the main page redirects to another page, we change the domain to the redirected page's domain
             if domain not in response.url:
                 domain = response.url.split("/")[2]
 
-            response = response.text
-            return_dict = {
-                "domain": domain,
-                "response": response,
-            }
-            responses.append(return_dict)
-
-            if (
-                not "404" in response
-                or not "error" in response
-                or not "not found" in response
+            # another input domain already landed on the same website, it is not crawled twice
+            if self.host_registry and not self.host_registry.claim(
+                requested, response.url
             ):
-                soup = bs(response, "lxml")
-                if soup.find_all("a"):
-                    for link in soup.find_all("a"):
-                        href = link.get("href")
-                        if href:
-                            if (
-                                "about" in href
-                                or "contact" in href
-                                and not "mailto" in href
-                            ):
-                                if domain in href:
-                                    new_links.append(href)
-                                else:
-                                    if not "http" in href:
-                                        if "/" == href[0]:
-                                            new_links.append(f"https://{domain}{href}")
-                                        else:
-                                            new_links.append(f"https://{domain}/{href}")
-                                    else:
-                                        new_links.append(href)
+                return
+
+            if self.crawl_cache:
+                unchanged = self.crawl_cache.revalidate(url, response)
+                cached = self.crawl_cache.get_address(domain)
+                # the address was found on the main page and the page did not change since
+                if unchanged and cached and cached[0] == url:
+                    yield self.make_cached_record(domain, url, cached)
+                    return
+
+            if response.status_code == 304:
+                # not modified, the page has no body but its links are known from the previous crawl
+                new_links = self.crawl_cache.get_links(url)
+            elif response.content:  # empty when the page is not html
+                self.archive_page(archived, domain, url, response)
+                response = response.text
+                with metrics.timer("parse_seconds"):
+                    document = PageDocument(response)
+                main_page = self.make_record(domain, response, document, url)
+
+                new_links = self.find_links(domain, response, document)
+                if self.crawl_cache:
+                    self.crawl_cache.set_links(url, new_links)
         except Exception as e:
-            pass
+            metrics.increment("errors_total", stage="crawl")
+            logging.error(f"Error occurred while crawling {domain}. Error: {e}")
 
-        new_links = list(set(new_links))  # remove duplicates
-        for link in new_links:
-            try:
-                response = requests.get(
-                    link,
-                    timeout=self.timeout,
-                    headers=headers,
-                    allow_redirects=True,
-                    verify=False,
-                )
-                if response.status_code == 200:
-                    return_dict = {
-                        "domain": domain,
-                        "response": response.text,
-                    }
-                    responses.append(return_dict)
+        if main_page:
+            yield main_page
 
+        frontier = LinkFrontier(domain, self.page_budget)
+        frontier.add(new_links)
+        for link in frontier:
+            try:
+                response = self.fetch(link, headers)
             except Exception as e:
-                pass
+                continue
+
+            if self.crawl_cache and self.crawl_cache.revalidate(link, response):
+                if cached and cached[0] == link:
+                    yield self.make_cached_record(domain, link, cached)
+                    return  # the parser stops at the first page with an address anyway
+
+            if response.status_code == 200 and response.content:
+                self.archive_page(archived, domain, link, response)
+                yield self.make_record(domain, response.text, url=link)
+
+    def crawl_website(self, domain, user_agent, output_arr):
+        """
+        Crawls the website and its "about" / "contact" pages
+        :param domain: str
+        :param user_agent: str
+        :param output_arr: list (the list of records of the website is appended to it)
+        """
+
+        with metrics.timer("crawl_domain_seconds"):
+            responses = list(self.iter_pages(domain, user_agent))
+        metrics.increment("domains_total", stage="crawl")
 
         if responses:
             output_arr.append(responses)
+
+    def crawl_and_parse(self, domain, user_agent, address_parser, output_arr):
+        """
+        Crawls the website and parses every page as soon as it arrives
+        The crawl stops at the first page an address is found on, the remaining pages are never fetched
+        :param domain: str
+        :param user_agent: str
+        :param address_parser: AddressParser
+        :param output_arr: list (the address of the website is appended to it)
+        """
+
+        metrics.increment("domains_total", stage="crawl")
+        for record in self.iter_pages(domain, user_agent):
+            addresses = []
+            address_parser.resolve_address(
+                address_parser.extract_candidates([record]), addresses
+            )
+
+            if addresses:
+                output_arr.extend(addresses)
+                break
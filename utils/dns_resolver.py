@@ -0,0 +1,170 @@
+import logging
+import socket
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from utils.metrics import metrics
+
+DAY = 24 * 60 * 60
+
+# Only these reasons are remembered for ttl seconds, the other dead domains are checked again on the next run
+CACHED_REASONS = {"NXDOMAIN", "no address"}
+
+
+class DnsPrefilter:
+    def __init__(
+        self,
+        cache_path="output/dns_cache.sqlite",
+        failed_log_path="output/failed_domains.log",
+        ttl=DAY,
+        num_workers=64,
+        connect_timeout=None,
+        retries=1,
+    ):
+        """
+        Resolves the domains concurrently before crawling, so dead domains never cost an HTTP request
+        Domains without a DNS record are remembered as dead for ttl seconds in a SQLite file
+        A transient DNS error is retried, and if it persists the domain is crawled anyway
+        :param cache_path: str
+        :param failed_log_path: str (dead domains are appended to it, with the reason)
+        :param ttl: int (seconds a dead domain is remembered)
+        :param num_workers: int (number of concurrent resolutions)
+        :param connect_timeout: float (if set, a TCP connection to port 443 is also tried) or None
+        :param retries: int (number of retries after a transient DNS error)
+        """
+
+        self.failed_log_path = failed_log_path
+        self.ttl = ttl
+        self.num_workers = num_workers
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+
+        self.lock = Lock()
+        self.connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS dead_hosts (domain TEXT PRIMARY KEY, reason TEXT, expires_at REAL)"
+        )
+        self.connection.commit()
+
+        self.stats = {"alive": 0, "dead": 0, "cached_dead": 0, "dns_errors": 0}
+
+    def get_cached_reason(self, domain):
+        """
+        Returns why the domain was found dead, if it was found dead recently
+        :param domain: str
+        :return: str or None
+        """
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT reason, expires_at FROM dead_hosts WHERE domain = ?", (domain,)
+            ).fetchone()
+
+        return row[0] if row and row[1] > time.time() else None
+
+    def resolve(self, domain):
+        """
+        Checks if the domain resolves (and accepts connections, if connect_timeout is set)
+        :param domain: str
+        :return: str (reason the domain is dead) or None if it is alive (or the DNS answer was a transient error)
+        """
+
+        for _ in range(self.retries + 1):
+            try:
+                with metrics.timer("dns_seconds"):
+                    addresses = socket.getaddrinfo(domain, 443, type=socket.SOCK_STREAM)
+                break
+            except socket.gaierror as e:
+                if e.errno == socket.EAI_NONAME:
+                    return "NXDOMAIN"
+                if e.errno == getattr(socket, "EAI_NODATA", None):
+                    return "no address"
+                # timeouts and SERVFAIL (EAI_AGAIN, EAI_FAIL) say nothing about the domain
+                error = e.strerror
+            except Exception as e:
+                error = e
+        else:
+            # the resolver failed, not the domain: let the crawler try it
+            metrics.increment("dns_errors_total")
+            with self.lock:
+                self.stats["dns_errors"] += 1
+            logging.warning(f"DNS error for {domain}, crawling it anyway: {error}")
+            return None
+
+        if not addresses:
+            return "no address"
+
+        if self.connect_timeout:
+            family, socket_type, proto, _, address = addresses[0]
+            try:
+                with socket.socket(family, socket_type, proto) as s:
+                    s.settimeout(self.connect_timeout)
+                    with metrics.timer("connect_seconds"):
+                        s.connect(address)
+            except Exception as e:
+                return f"unreachable: {e}"
+
+        return None
+
+    def check(self, domain):
+        """
+        Checks the domain, using the dead domain cache first
+        :param domain: str
+        :return: str (reason the domain is dead) or None if it is alive
+        """
+
+        reason = self.get_cached_reason(domain)
+        if reason:
+            with self.lock:
+                self.stats["cached_dead"] += 1
+            return reason
+
+        reason = self.resolve(domain)
+        if reason:
+            metrics.increment("dead_domains_total", reason=reason.split(":")[0])
+        with self.lock:
+            if reason:
+                self.stats["dead"] += 1
+            if reason in CACHED_REASONS:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO dead_hosts (domain, reason, expires_at) VALUES (?, ?, ?)",
+                    (domain, reason, time.time() + self.ttl),
+                )
+                self.connection.commit()
+            elif not reason:
+                self.stats["alive"] += 1
+
+        return reason
+
+    def filter(self, domains):
+        """
+        Resolves the domains concurrently and keeps only the alive ones
+        The dead domains are written to the failed domains log with the reason
+        :param domains: list of str
+        :return: list of str (the alive domains, in the input order)
+        """
+
+        with ThreadPoolExecutor(self.num_workers) as executor:
+            reasons = list(executor.map(self.check, domains))
+
+        dead = [(domain, reason) for domain, reason in zip(domains, reasons) if reason]
+        if dead:
+            with open(self.failed_log_path, "a") as f:
+                f.write(
+                    "".join(
+                        f"root - ERROR - {domain} - {reason}\n"
+                        for domain, reason in dead
+                    )
+                )
+
+        return [domain for domain, reason in zip(domains, reasons) if not reason]
+
+    def close(self):
+        """
+        Closes the SQLite connection
+        """
+
+        with self.lock:
+            self.connection.close()
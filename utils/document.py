@@ -0,0 +1,87 @@
+from lxml import etree
+from lxml import html as lxml_html
+
+from utils.structured_data import extract_structured_addresses, has_markers
+
+# Text inside these tags is never shown on the page
+SKIPPED_TAGS = {"script", "style", "noscript", "template"}
+
+# Text inside these tags is shown, but it is navigation (menus), not content
+NAVIGATION_TAGS = {"nav"}
+
+_find_hrefs = etree.XPath("//a/@href", smart_strings=False)
+
+
+class PageDocument:
+    __slots__ = ("links", "text_nodes", "navigation_nodes", "structured_addresses")
+
+    def __init__(self, response):
+        """
+        Parses the page once with lxml and keeps what both the crawler and the parser need
+        The lxml tree itself is not kept, only the hrefs of the links and the text nodes (in document order)
+        navigation_nodes holds the indexes of the text nodes that are inside a <nav> element
+        structured_addresses holds the addresses the page publishes as JSON-LD, microdata or hCard
+        :param response: str or bytes (html of the page)
+        """
+
+        try:
+            tree = lxml_html.document_fromstring(response)
+        except ValueError:
+            # lxml refuses str input that starts with an xml encoding declaration
+            tree = lxml_html.document_fromstring(response.encode("utf-8"))
+
+        self.links = _find_hrefs(tree)
+        self.structured_addresses = (
+            extract_structured_addresses(tree) if has_markers(response) else []
+        )
+        self.text_nodes = []
+        self.navigation_nodes = set()
+
+        skipped_depth = 0
+        navigation_depth = 0
+        for event, element in etree.iterwalk(tree, events=("start", "end")):
+            # comments and processing instructions have a function as their tag
+            is_tag = isinstance(element.tag, str)
+            if event == "start":
+                if is_tag and element.tag in NAVIGATION_TAGS:
+                    navigation_depth += 1
+                if is_tag and element.tag in SKIPPED_TAGS:
+                    skipped_depth += 1
+                elif is_tag and not skipped_depth and element.text:
+                    self.add_text(element.text, navigation_depth > 0)
+            else:
+                if is_tag and element.tag in NAVIGATION_TAGS:
+                    navigation_depth -= 1
+                if is_tag and element.tag in SKIPPED_TAGS:
+                    skipped_depth -= 1
+                if not skipped_depth and element.tail:
+                    self.add_text(element.tail, navigation_depth > 0)
+
+    @classmethod
+    def from_text_nodes(cls, text_nodes, navigation_nodes=(), structured_addresses=()):
+        """
+        Creates a document from already extracted text nodes (e.g. stored by a text only PageStore)
+        :param text_nodes: list of str
+        :param navigation_nodes: iterable of int
+        :param structured_addresses: iterable of dicts
+        :return: PageDocument (without links)
+        """
+
+        document = cls.__new__(cls)
+        document.links = []
+        document.text_nodes = text_nodes
+        document.navigation_nodes = set(navigation_nodes)
+        document.structured_addresses = list(structured_addresses)
+        return document
+
+    def add_text(self, text, is_navigation=False):
+        """
+        Keeps the text node if it is not only whitespace
+        :param text: str
+        :param is_navigation: bool (the text is inside a <nav> element)
+        """
+
+        if not text.isspace():
+            if is_navigation:
+                self.navigation_nodes.add(len(self.text_nodes))
+            self.text_nodes.append(text)
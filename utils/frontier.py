@@ -0,0 +1,77 @@
+import heapq
+from urllib.parse import urlsplit
+
+
+def strip_host(host):
+    """
+    Normalizes a host name so that "www.example.com" and "example.com" are the same host
+    :param host: str
+    :return: str
+    """
+
+    host = (host or "").lower().rstrip(".")
+    return host[4:] if host.startswith("www.") else host
+
+
+class LinkFrontier:
+    def __init__(self, domain, budget=5):
+        """
+        Queue of the "about" / "contact" links of a website, best links first
+        Contact pages come before about pages, then shallow paths before deep ones
+        Links to other hosts are dropped, and at most budget links are handed out
+        :param domain: str
+        :param budget: int (maximum number of pages to fetch)
+        """
+
+        self.host = strip_host(domain.split(":")[0])
+        self.budget = budget
+        self.heap = []
+        self.seen = set()
+
+    def score(self, link):
+        """
+        Scores a link, lower is better
+        :param link: str
+        :return: tuple
+        """
+
+        lowered = link.lower()
+        if "contact" in lowered:
+            kind = 0
+        elif "about" in lowered:
+            kind = 1
+        else:
+            kind = 2
+
+        depth = len([part for part in urlsplit(link).path.split("/") if part])
+        return (kind, depth, len(link), link)
+
+    def add(self, links):
+        """
+        Adds the links of the same host to the frontier
+        :param links: list of str (absolute urls)
+        """
+
+        for link in links:
+            if link in self.seen:
+                continue
+            self.seen.add(link)
+
+            try:
+                host = urlsplit(link).hostname
+            except ValueError:
+                continue
+            if strip_host(host) != self.host:
+                continue
+
+            heapq.heappush(self.heap, self.score(link))
+
+    def __iter__(self):
+        """
+        Hands out the best remaining link until the frontier is empty or the budget is spent
+        :return: generator of str
+        """
+
+        while self.heap and self.budget > 0:
+            self.budget -= 1
+            yield heapq.heappop(self.heap)[-1]
@@ -0,0 +1,161 @@
+import os
+import re
+import sys
+import numpy as np
+
+# Zip+4 codes (e.g. "10001-1234") are looked up by their first 5 digits
+ZIP_PLUS_FOUR_REGEX = re.compile(r"^(\d{5})[-\s]\d{4}$")
+
+INDEX_FILES = ["postcodes", "countries", "regions", "cities", "names"]
+
+
+class PostcodeGazetteer:
+    def __init__(self, postcodes, countries, regions, cities, names, country=None):
+        """
+        Offline postcode -> (country, region, city) resolver
+        The index is a set of sorted, fixed width numpy arrays, normally memory-mapped from disk (see load)
+        :param postcodes: numpy array of bytes (sorted by postcode, then country)
+        :param countries: numpy array of bytes (ISO country code of every postcode)
+        :param regions: numpy array of int (index of the region name in names)
+        :param cities: numpy array of int (index of the city name in names)
+        :param names: numpy array of str (region and city names)
+        :param country: str (country code preferred when a postcode exists in several countries)
+        """
+
+        self.postcodes = postcodes
+        self.countries = countries
+        self.regions = regions
+        self.cities = cities
+        self.names = names
+        self.country = country.upper().encode() if country else None
+
+    @staticmethod
+    def normalize(postcode):
+        """
+        Normalizes a postcode the way it is stored in the index
+        :param postcode: str
+        :return: str
+        """
+
+        postcode = " ".join(postcode.split()).upper()
+        match = ZIP_PLUS_FOUR_REGEX.match(postcode)
+        return match.group(1) if match else postcode
+
+    @classmethod
+    def build(cls, source_path, index_dir):
+        """
+        Builds the index from a GeoNames postal code dump (e.g. US.txt or allCountries.txt)
+        The dump is tab separated: country code, postal code, place name, admin name1, ...
+        :param source_path: str
+        :param index_dir: str (directory the index files are written to)
+        """
+
+        entries = {}
+        with open(source_path, "r", encoding="utf-8") as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) < 4:
+                    continue
+
+                country, postcode, city, region = fields[:4]
+                key = (cls.normalize(postcode), country.upper())
+                if key[0] and key not in entries:  # keep the first place of a postcode
+                    entries[key] = (region, city)
+
+        keys = sorted(entries)
+        names = sorted({name for value in entries.values() for name in value})
+        name_index = {name: i for i, name in enumerate(names)}
+
+        os.makedirs(index_dir, exist_ok=True)
+        np.save(
+            os.path.join(index_dir, "postcodes.npy"),
+            np.array([postcode.encode() for postcode, _ in keys], dtype=bytes),
+        )
+        np.save(
+            os.path.join(index_dir, "countries.npy"),
+            np.array([country.encode() for _, country in keys], dtype="S2"),
+        )
+        np.save(
+            os.path.join(index_dir, "regions.npy"),
+            np.array([name_index[entries[key][0]] for key in keys], dtype=np.int32),
+        )
+        np.save(
+            os.path.join(index_dir, "cities.npy"),
+            np.array([name_index[entries[key][1]] for key in keys], dtype=np.int32),
+        )
+        np.save(os.path.join(index_dir, "names.npy"), np.array(names, dtype=str))
+
+    @classmethod
+    def load(cls, index_dir, country=None):
+        """
+        Memory-maps an index built with build
+        :param index_dir: str
+        :param country: str (preferred country code)
+        :return: PostcodeGazetteer
+        """
+
+        arrays = [
+            np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+            for name in INDEX_FILES
+        ]
+        return cls(*arrays, country=country)
+
+    def lookup_many(self, postcodes):
+        """
+        Resolves many postcodes at once with a single vectorized binary search
+        :param postcodes: list of str
+        :return: list of dicts (same fields as a Nominatim address) or None for unknown postcodes
+        """
+
+        if not postcodes:
+            return []
+
+        encoded = [self.normalize(postcode).encode() for postcode in postcodes]
+        queries = np.array(encoded, dtype=self.postcodes.dtype)
+        starts = np.searchsorted(self.postcodes, queries, side="left")
+        ends = np.searchsorted(self.postcodes, queries, side="right")
+
+        results = []
+        for query, start, end in zip(encoded, starts, ends):
+            # a query longer than the stored postcodes would be truncated by numpy
+            if start == end or len(query) > self.postcodes.dtype.itemsize:
+                results.append(None)
+                continue
+
+            position = start
+            if self.country:
+                for i in range(start, end):
+                    if self.countries[i] == self.country:
+                        position = i
+                        break
+
+            results.append(
+                {
+                    # only the ISO code is known, the "country" name is left to the geocoder
+                    "country_code": self.countries[position].decode().lower(),
+                    "state": str(self.names[self.regions[position]]),
+                    "city": str(self.names[self.cities[position]]),
+                    "postcode": self.postcodes[position].decode(),
+                }
+            )
+
+        return results
+
+    def lookup(self, postcode):
+        """
+        Resolves a single postcode
+        :param postcode: str
+        :return: dict or None
+        """
+
+        return self.lookup_many([postcode])[0]
+
+
+if __name__ == "__main__":
+    # python -m utils.gazetteer <GeoNames dump> <index directory>
+    if len(sys.argv) != 3:
+        print("Usage: python -m utils.gazetteer <GeoNames dump> <index directory>")
+        sys.exit(1)
+
+    PostcodeGazetteer.build(sys.argv[1], sys.argv[2])
+    print(f"Gazetteer index written to {sys.argv[2]}")
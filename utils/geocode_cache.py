@@ -0,0 +1,123 @@
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from threading import Lock
+
+DAY = 24 * 60 * 60
+
+
+class GeocodeCache:
+    def __init__(
+        self,
+        path="output/geocode_cache.sqlite",
+        max_entries=10000,
+        ttl=30 * DAY,
+        negative_ttl=7 * DAY,
+        error_ttl=DAY // 24,
+    ):
+        """
+        Two tier cache for geocoder lookups: an in-memory LRU in front of a SQLite file
+        Misses (no location found) and errors (e.g. timeouts) are cached too, for a shorter time
+        :param path: str (path of the SQLite file)
+        :param max_entries: int (size of the in-memory LRU)
+        :param ttl: int (seconds a found location is kept)
+        :param negative_ttl: int (seconds a query without a location is kept)
+        :param error_ttl: int (seconds a query that failed is kept)
+        """
+
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.error_ttl = error_ttl
+
+        self.memory = OrderedDict()  # query -> (raw location or None, expires at)
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS geocode (query TEXT PRIMARY KEY, raw TEXT, expires_at REAL)"
+        )
+        self.connection.commit()
+
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    @staticmethod
+    def normalize(query):
+        """
+        Normalizes the query so that the same address written differently shares an entry
+        :param query: str
+        :return: str
+        """
+
+        return " ".join(query.split()).lower()
+
+    def get(self, query):
+        """
+        Looks the query up, first in memory and then on disk
+        :param query: str
+        :return: tuple (found, raw location or None for a cached miss)
+        """
+
+        key = self.normalize(query)
+        now = time.time()
+
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry and entry[1] > now:
+                self.memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return True, entry[0]
+
+            row = self.connection.execute(
+                "SELECT raw, expires_at FROM geocode WHERE query = ?", (key,)
+            ).fetchone()
+            if row and row[1] > now:
+                raw = json.loads(row[0]) if row[0] else None
+                self._remember(key, raw, row[1])
+                self.stats["disk_hits"] += 1
+                return True, raw
+
+            self.stats["misses"] += 1
+            return False, None
+
+    def set(self, query, raw, error=False):
+        """
+        Stores the result of a geocoder lookup
+        :param query: str
+        :param raw: dict (raw location returned by the geocoder) or None if nothing was found
+        :param error: bool (the lookup failed, e.g. because of a timeout)
+        """
+
+        key = self.normalize(query)
+        if error:
+            expires_at = time.time() + self.error_ttl
+        elif raw is None:
+            expires_at = time.time() + self.negative_ttl
+        else:
+            expires_at = time.time() + self.ttl
+
+        with self.lock:
+            self._remember(key, raw, expires_at)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO geocode (query, raw, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(raw) if raw else None, expires_at),
+            )
+            self.connection.commit()
+
+    def _remember(self, key, raw, expires_at):
+        """
+        Puts the entry in the in-memory LRU, evicting the least recently used entry if it is full
+        """
+
+        self.memory[key] = (raw, expires_at)
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def close(self):
+        """
+        Closes the SQLite connection
+        """
+
+        with self.lock:
+            self.connection.close()
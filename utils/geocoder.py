@@ -0,0 +1,207 @@
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+
+from geopy.geocoders import Nominatim
+from geopy.location import Location
+
+from utils.metrics import metrics
+
+
+class NominatimBackend:
+    def __init__(self, user_agent, timeout=2):
+        """
+        Geocoder backend that queries the public Nominatim service
+        :param user_agent: str
+        :param timeout: int
+        """
+
+        self.timeout = timeout
+        self.geolocator = Nominatim(user_agent=user_agent)
+
+    def geocode(self, query):
+        """
+        Geocodes the query
+        :param query: str
+        :return: dict (raw Nominatim result, with "address") or None if nothing was found
+        """
+
+        location = self.geolocator.geocode(
+            query, addressdetails=True, timeout=self.timeout
+        )
+        return location.raw if location else None
+
+
+class LocalGeocoderBackend:
+    def __init__(self, entries=None, latency=0.0):
+        """
+        Offline stand-in for Nominatim, for tests and benchmarks
+        Known queries return their entry, any other query returns a made-up address built from the query
+        :param entries: dict (query -> raw result or None) or None
+        :param latency: float (seconds every lookup sleeps, to mimic the round trip)
+        """
+
+        self.entries = entries or {}
+        self.latency = latency
+
+    def geocode(self, query):
+        """
+        Geocodes the query
+        :param query: str
+        :return: dict (raw result, with "address") or None if nothing was found
+        """
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if query in self.entries:
+            return self.entries[query]
+
+        is_postcode = query.replace("-", "").replace(" ", "").isdigit()
+        address = {"country": "United States", "state": "Local", "city": "Local"}
+        address["postcode" if is_postcode else "road"] = query
+        return {"display_name": query, "lat": "0", "lon": "0", "address": address}
+
+
+class TokenBucket:
+    def __init__(self, rate=1.0, burst=1):
+        """
+        Token bucket rate limiter, shared by all the threads
+        :param rate: float (tokens added per second)
+        :param burst: int (maximum number of tokens saved up)
+        """
+
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.lock = Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available and takes it
+        """
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+class GeocodingService:
+    def __init__(self, backend, rate=1.0, burst=1, workers=2, geocode_cache=None):
+        """
+        Geocoding stage: the queries are sent to the backend by a small pool of workers, behind a token bucket
+        Identical queries in flight at the same time are coalesced, only the first one reaches the backend
+        :param backend: NominatimBackend or LocalGeocoderBackend
+        :param rate: float (maximum number of backend requests per second)
+        :param burst: int
+        :param workers: int (number of concurrent backend requests)
+        :param geocode_cache: GeocodeCache or None
+        """
+
+        self.backend = backend
+        self.workers = workers
+        self.geocode_cache = geocode_cache
+        self.bucket = TokenBucket(rate, burst)
+        self.executor = ThreadPoolExecutor(workers)
+        self.in_flight = {}  # query -> Future
+        self.lock = Lock()
+
+        self.stats = {"requests": 0, "coalesced": 0}
+
+    @staticmethod
+    def to_location(raw):
+        """
+        Builds a geopy Location from a raw result
+        :param raw: dict or None
+        :return: geopy Location or None
+        """
+
+        if not raw:
+            return None
+
+        return Location(
+            raw.get("display_name"),
+            (float(raw.get("lat")), float(raw.get("lon"))),
+            raw,
+        )
+
+    def _lookup(self, query):
+        with metrics.timer("geocode_wait_seconds"):
+            self.bucket.acquire()
+        try:
+            with metrics.timer("geocode_seconds"):
+                raw = self.backend.geocode(query)
+        except Exception:
+            metrics.increment("errors_total", stage="geocode")
+            if self.geocode_cache:
+                self.geocode_cache.set(query, None, error=True)
+            raise
+        finally:
+            with self.lock:
+                self.stats["requests"] += 1
+
+        if self.geocode_cache:
+            self.geocode_cache.set(query, raw)
+
+        return self.to_location(raw)
+
+    def _forget(self, query):
+        with self.lock:
+            self.in_flight.pop(query, None)
+
+    def submit(self, query):
+        """
+        Starts geocoding the query without waiting for the result
+        :param query: str
+        :return: Future (of a geopy Location or None)
+        """
+
+        if self.geocode_cache:
+            found, raw = self.geocode_cache.get(query)
+            if found:
+                metrics.increment("geocode_lookups_total", result="cache_hit")
+                future = Future()
+                future.set_result(self.to_location(raw))
+                return future
+
+        with self.lock:
+            future = self.in_flight.get(query)
+            if future:
+                self.stats["coalesced"] += 1
+                metrics.increment("geocode_lookups_total", result="coalesced")
+                return future
+
+            metrics.increment("geocode_lookups_total", result="request")
+            future = self.executor.submit(self._lookup, query)
+            self.in_flight[query] = future
+
+        future.add_done_callback(lambda _: self._forget(query))
+        return future
+
+    def geocode(self, query):
+        """
+        Geocodes the query and waits for the result
+        :param query: str
+        :return: geopy Location or None
+        """
+
+        return self.submit(query).result()
+
+    def close(self):
+        """
+        Stops the workers
+        """
+
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,123 @@
+from threading import Lock
+
+
+def host_of(domain):
+    """
+    Returns the host of an input domain, as it is resolved and crawled: lowercase, without scheme, path or trailing dots
+    :param domain: str
+    :return: str ("" if nothing is left)
+    """
+
+    domain = str(domain).strip().lower()
+    if "://" in domain:
+        domain = domain.split("://", 1)[1]
+    return domain.split("/", 1)[0].rstrip(".")
+
+
+def normalize_domain(domain):
+    """
+    Normalizes an input domain to compare it with others: the host without "www."
+    :param domain: str
+    :return: str ("" if nothing is left)
+    """
+
+    domain = host_of(domain)
+    return domain[4:] if domain.startswith("www.") else domain
+
+
+class HostRegistry:
+    def __init__(self):
+        """
+        Shared registry of the websites (final hosts, after the redirects) being crawled
+        Input domains that redirect to a website already crawled for another input domain (brand aliases,
+        parked portfolios, acquired companies) are not crawled again, they get the address of that website
+        """
+
+        self.lock = Lock()
+        self.seen = set()  # normalized input domains
+        self.owners = {}  # final host -> input domain it is crawled for
+        self.hosts = {}  # input domain -> final host it crawls
+        # input domain -> final host, crawled for another input domain
+        self.aliases = {}
+        self.addresses = {}  # final host -> address
+        # final host -> aliases committed before the host had an address
+        self.waiting = {}
+        self.stats = {"duplicates": 0, "aliases": 0}
+
+    def dedupe(self, domains, skip=None):
+        """
+        Leaves out the input domains already seen, compared in their normalized form
+        The host of the domain is kept as it is (only lowercased), a website that only answers on its "www."
+        host is still resolved and crawled there
+        :param domains: iterable of str
+        :param skip: function (hosts for which it returns True are left out too) or None
+        :return: generator of str (hosts)
+        """
+
+        for domain in domains:
+            host = host_of(domain)
+            key = normalize_domain(host)
+            if not key or key in self.seen:
+                self.stats["duplicates"] += 1
+                continue
+
+            self.seen.add(key)
+            if not (skip and skip(host)):
+                yield host
+
+    def claim(self, domain, final_url):
+        """
+        Registers the website an input domain landed on, the first input domain to land on it crawls it
+        :param domain: str (input domain)
+        :param final_url: str (url of the main page after the redirects)
+        :return: bool (False if the website is already crawled for another input domain)
+        """
+
+        host = normalize_domain(final_url)
+        domain = normalize_domain(domain)
+
+        with self.lock:
+            owner = self.owners.setdefault(host, domain)
+            if owner == domain:
+                self.hosts[domain] = host
+                return True
+
+            self.aliases[domain] = host
+            self.stats["aliases"] += 1
+            return False
+
+    def add_aliases(self, domains, addresses):
+        """
+        Records the addresses found and adds a row for every alias whose website has an address
+        An alias committed before its website got an address (the website is still being geocoded in a
+        streaming run) waits, its row is added with the chunk that brings the address of the website
+        :param domains: list of str (input domains of the chunk, as crawled)
+        :param addresses: list (the addresses found in the chunk)
+        :return: list (the addresses and the alias rows, with "alias_of" set to the final host)
+        """
+
+        with self.lock:
+            for address in addresses:
+                # the domain of an address is the input domain, or the host it redirected to when the
+                # crawler switched to it, either way it leads to the host claimed for it
+                domain = normalize_domain(address.get("domain"))
+                self.addresses[self.hosts.get(domain, domain)] = address.get("address")
+
+            for domain in domains:
+                host = self.aliases.get(normalize_domain(domain))
+                # an input domain that is the website itself already has its row
+                if host and host != normalize_domain(domain):
+                    self.waiting.setdefault(host, []).append(domain)
+
+            rows = []
+            for host in [host for host in self.waiting if host in self.addresses]:
+                for domain in self.waiting.pop(host):
+                    rows.append(
+                        {
+                            "domain": domain,
+                            "address": self.addresses[host],
+                            "alias_of": host,
+                        }
+                    )
+
+        return addresses + rows
@@ -1,9 +1,22 @@
+import os
 import sys
 import pandas as pd
-from fastparquet import ParquetFile
+from fastparquet import ParquetFile, write
 from colorama import init as colorama_init
 from colorama import Fore, Style
 
+OUTPUT_PARQUET = "output/addresses.snappy.parquet"
+COLUMNS = [
+    "domain",
+    "country",
+    "region",
+    "city",
+    "postcode",
+    "road",
+    "house_number",
+    "alias_of",  # the website the domain redirects to, crawled for another domain
+]
+
 
 class IOHandler:
     def parse_parquet(self, file_path, selected_column):
@@ -16,41 +29,130 @@ class IOHandler:
 
         try:
             parquet_file = ParquetFile(file_path)
-            return parquet_file.to_pandas()[selected_column]
+            return parquet_file.to_pandas(columns=[selected_column])[selected_column]
         except:
             print("Error: Could not parse parquet file")
             sys.exit(1)
 
-    def write_to_parquet(self, address_array):
+    def count_parquet_rows(self, file_path):
         """
-        Write the addresses to a parquet file
-        :param address_array: The array of addresses to be written to the parquet file
-        :param file_name: str
+        Count the rows of the parquet file from its metadata, without reading any data
+        :param file_path: The path to the parquet file
+        :return: int
         """
 
         try:
-            # Create a list of dictionaries, each representing a row of data
-            data = []
-            for element in address_array:
-                row = {
-                    "domain": element.get("domain"),
-                    "country": element.get("address", {}).get("country", ""),
-                    "region": element.get("address", {}).get("region", ""),
-                    "city": element.get("address", {}).get("city", ""),
-                    "postcode": element.get("address", {}).get("postcode", ""),
-                    "road": element.get("address", {}).get("road", ""),
-                    "house_number": element.get("address", {}).get("house_number", ""),
-                }
-                data.append(row)
-
-            # Create a DataFrame from the list of dictionaries
-            df = pd.DataFrame(data)
-
-            # Write the DataFrame to a parquet file
-            df.to_parquet("output/addresses.snappy.parquet", compression="snappy")
-            print(
-                "\nAddresses written to addresses.snappy.parquet in the output folder."
-            )
+            return ParquetFile(file_path).count()
+        except:
+            print("Error: Could not parse parquet file")
+            sys.exit(1)
+
+    def iter_parquet(self, file_path, selected_column, batch_size, skip=None):
+        """
+        Stream the selected column of the parquet file in batches
+        Only that column is read, one row group at a time, so the memory usage does not depend on the file size
+        :param file_path: The path to the parquet file
+        :param selected_column: The column to be read from the parquet file
+        :param batch_size: int (number of values per batch)
+        :param skip: function (values for which it returns True are left out) or None
+        :return: generator of lists
+        """
+
+        try:
+            parquet_file = ParquetFile(file_path)
+        except:
+            print("Error: Could not parse parquet file")
+            sys.exit(1)
+
+        batch = []
+        for row_group in parquet_file.iter_row_groups(
+            columns=[selected_column], index=False
+        ):
+            for value in row_group[selected_column]:
+                if skip and skip(value):
+                    continue
+
+                batch.append(value)
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+
+        if batch:
+            yield batch
+
+    def addresses_to_dataframe(self, address_array):
+        """
+        Convert the addresses to a pandas dataframe, one row per domain
+        :param address_array: The array of addresses
+        :return: pandas dataframe
+        """
+
+        # Create a list of dictionaries, each representing a row of data
+        data = []
+        for element in address_array:
+            row = {
+                "domain": element.get("domain"),
+                "country": element.get("address", {}).get("country", ""),
+                "region": element.get("address", {}).get("region", ""),
+                "city": element.get("address", {}).get("city", ""),
+                "postcode": element.get("address", {}).get("postcode", ""),
+                "road": element.get("address", {}).get("road", ""),
+                "house_number": element.get("address", {}).get("house_number", ""),
+                "alias_of": element.get("alias_of"),
+            }
+            data.append(row)
+
+        # Create a DataFrame from the list of dictionaries
+        return pd.DataFrame(data, columns=COLUMNS)
+
+    def write_part(self, address_array, file_path):
+        """
+        Write the addresses to a new parquet file, atomically: a temporary file is written and synced to disk,
+        then renamed, so after a crash the file is either complete or missing
+        :param address_array: The array of addresses to be written
+        :param file_path: str
+        :return: bool (False if there was nothing to write)
+        """
+
+        # the missing fields stay null, as in the final parquet file
+        df = self.addresses_to_dataframe(address_array)
+        if df.empty:
+            return False
+
+        temporary_path = f"{file_path}.tmp"
+        write(temporary_path, df, compression="SNAPPY", object_encoding="utf8")
+        with open(temporary_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(temporary_path, file_path)
+
+        # the rename itself is only durable once the directory is synced
+        directory = os.open(os.path.dirname(file_path) or ".", os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        return True
+
+    def concat_parquet(self, paths, file_path=OUTPUT_PARQUET):
+        """
+        Combine parquet files (the parts of a checkpoint or the outputs of the shards) into the final parquet file
+        If a domain is in more than one file (e.g. a chunk was redone after a crash), its last row is kept
+        :param paths: list of str
+        :param file_path: str
+        :return: int (number of addresses written)
+        """
+
+        try:
+            frames = [pd.read_parquet(path) for path in paths]
+            df = pd.concat(frames) if frames else pd.DataFrame(columns=COLUMNS)
+            df = df.drop_duplicates("domain", keep="last").reset_index(drop=True)
+            # files written before the alias_of column existed get nulls in it
+            df = df.reindex(columns=COLUMNS).astype(object)
+            df = df.where(df.notna(), None)
+
+            df.to_parquet(file_path, compression="snappy")
+            print(f"\nAddresses written to {file_path}")
+            return len(df)
         except Exception as e:
             print(f"{Fore.RED}Error: Could not write to parquet file{Style.RESET_ALL}")
             print(str(e))
@@ -63,22 +165,7 @@ class IOHandler:
         """
 
         try:
-            # Create a list of dictionaries, each representing a row of data
-            data = []
-            for element in address_array:
-                row = {
-                    "domain": element.get("domain"),
-                    "country": element.get("address", {}).get("country", ""),
-                    "region": element.get("address", {}).get("region", ""),
-                    "city": element.get("address", {}).get("city", ""),
-                    "postcode": element.get("address", {}).get("postcode", ""),
-                    "road": element.get("address", {}).get("road", ""),
-                    "house_number": element.get("address", {}).get("house_number", ""),
-                }
-                data.append(row)
-
-            # Create a DataFrame from the list of dictionaries
-            df = pd.DataFrame(data)
+            df = self.addresses_to_dataframe(address_array)
 
             # Write the DataFrame to a csv file
             df.to_csv("output/addresses.csv", index=False)
@@ -0,0 +1,19 @@
+import logging
+
+LOG_PATH = "output/app.log"
+
+
+def setup_logging(path=LOG_PATH, append=False):
+    """
+    Sends the log of the run to a file
+    Called by the entry points, importing a module never touches the log file
+    :param path: str
+    :param append: bool (keep the lines already in the file, e.g. in worker processes)
+    """
+
+    logging.basicConfig(
+        filename=path,
+        filemode="a" if append else "w",
+        format="%(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
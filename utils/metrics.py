@@ -0,0 +1,254 @@
+import bisect
+import json
+import os
+import time
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+
+# Upper bounds of the histogram buckets, the last bucket (+Inf) is implicit
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+)
+BYTE_BUCKETS = tuple(1024 * 4**i for i in range(8))  # 1 KiB to 16 MiB
+
+
+class Histogram:
+    def __init__(self, buckets):
+        """
+        Cumulative-bucket histogram, in the Prometheus style
+        :param buckets: tuple (sorted upper bounds)
+        """
+
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, counts, count, total):
+        for index, value in enumerate(counts):
+            self.counts[index] += value
+        self.count += count
+        self.sum += total
+
+    def quantile(self, q):
+        """
+        Estimates a quantile by linear interpolation inside its bucket
+        :param q: float (between 0 and 1)
+        :return: float or None if nothing was observed
+        """
+
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[index - 1] if index else 0
+                if index == len(self.buckets):
+                    return lower  # above the last bound, nothing better to say
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+
+        return self.buckets[-1]
+
+
+class Metrics:
+    def __init__(self):
+        """
+        Registry of the counters and histograms of a run, shared by all the stages and threads
+        Histograms named "*_bytes" use byte buckets, all the others are latencies in seconds
+        """
+
+        self.lock = Lock()
+        self.counters = {}  # (name, labels) -> int
+        self.histograms = {}  # name -> Histogram
+        self._stop = Event()
+        self._dumper = None
+
+    def increment(self, name, amount=1, **labels):
+        """
+        Increments a counter
+        :param name: str
+        :param amount: int
+        :param labels: str (e.g. stage="crawl")
+        """
+
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def _histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            buckets = BYTE_BUCKETS if name.endswith("_bytes") else LATENCY_BUCKETS
+            histogram = self.histograms[name] = Histogram(buckets)
+        return histogram
+
+    def observe(self, name, value):
+        """
+        Records a value in a histogram
+        :param name: str
+        :param value: float
+        """
+
+        with self.lock:
+            self._histogram(name).observe(value)
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Records the time spent in the block in a histogram
+        :param name: str
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def take(self):
+        """
+        Returns the recorded values and clears them, used to send the metrics of a worker process to the main one
+        :return: dict
+        """
+
+        with self.lock:
+            state = {
+                "counters": list(self.counters.items()),
+                "histograms": {
+                    name: (histogram.counts, histogram.count, histogram.sum)
+                    for name, histogram in self.histograms.items()
+                },
+            }
+            self.counters = {}
+            self.histograms = {}
+
+        return state
+
+    def merge(self, state):
+        """
+        Adds the values returned by take (of another process) to this registry
+        :param state: dict
+        """
+
+        with self.lock:
+            for key, value in state["counters"]:
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, values in state["histograms"].items():
+                self._histogram(name).merge(*values)
+
+    def to_dict(self):
+        """
+        Summarizes the metrics
+        :return: dict
+        """
+
+        with self.lock:
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                label = ",".join(f"{key}={value}" for key, value in labels)
+                counters[f"{name}{{{label}}}" if label else name] = value
+
+            histograms = {
+                name: {
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "mean": (
+                        histogram.sum / histogram.count if histogram.count else None
+                    ),
+                    "p50": histogram.quantile(0.5),
+                    "p90": histogram.quantile(0.9),
+                    "p99": histogram.quantile(0.99),
+                }
+                for name, histogram in sorted(self.histograms.items())
+            }
+
+        return {"counters": counters, "histograms": histograms}
+
+    def to_prometheus(self):
+        """
+        Formats the metrics in the Prometheus text exposition format
+        :return: str
+        """
+
+        lines = []
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                label = ",".join(f'{key}="{value}"' for key, value in labels)
+                lines.append(
+                    f"{name}{{{label}}} {value}" if label else f"{name} {value}"
+                )
+
+            for name, histogram in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                cumulative = 0
+                for bound, count in zip([*histogram.buckets, "+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum {histogram.sum}")
+                lines.append(f"{name}_count {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """
+        Writes the metrics to a file, in the Prometheus text format if the path ends with ".prom", else as JSON
+        The file is replaced atomically, so a reader never sees a half written dump
+        :param path: str
+        """
+
+        if path.endswith(".prom"):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), indent=2)
+
+        with open(f"{path}.tmp", "w") as f:
+            f.write(content)
+        os.replace(f"{path}.tmp", path)
+
+    def dump_every(self, path, interval):
+        """
+        Starts writing the metrics to the file every interval seconds, until close is called
+        :param path: str
+        :param interval: float
+        """
+
+        def dump_worker():
+            while not self._stop.wait(interval):
+                self.dump(path)
+
+        self._dumper = Thread(target=dump_worker, daemon=True)
+        self._dumper.start()
+
+    def close(self):
+        """
+        Stops the periodic dumps
+        """
+
+        self._stop.set()
+        if self._dumper:
+            self._dumper.join()
+
+
+# Registry of the current process, every stage records into it
+metrics = Metrics()
@@ -0,0 +1,115 @@
+import json
+import os
+import zlib
+from threading import Lock
+
+from utils.document import PageDocument
+
+_read_fds = {}  # path -> file descriptor, opened once per process
+
+
+class PageHandle:
+    __slots__ = ("path", "offset", "length", "text_only")
+
+    def __init__(self, path, offset, length, text_only):
+        """
+        Lightweight reference to a page spooled to a PageStore segment file
+        Handles can be pickled, so worker processes read the page from disk themselves
+        :param path: str (path of the segment file)
+        :param offset: int
+        :param length: int (compressed length)
+        :param text_only: bool (only the text nodes of the page were stored)
+        """
+
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self.text_only = text_only
+
+    def read_bytes(self):
+        """
+        Reads and decompresses the stored record
+        :return: bytes
+        """
+
+        fd = _read_fds.get(self.path)
+        if fd is None:
+            fd = _read_fds[self.path] = os.open(self.path, os.O_RDONLY)
+
+        return zlib.decompress(os.pread(fd, self.length, self.offset))
+
+    def load_document(self):
+        """
+        Loads the stored page as a PageDocument
+        :return: PageDocument
+        """
+
+        if self.text_only:
+            return PageDocument.from_text_nodes(*json.loads(self.read_bytes()))
+
+        # the html was stored utf-8 encoded, lxml would read undeclared bytes as latin-1
+        return PageDocument(self.read_bytes().decode("utf-8"))
+
+
+class PageStore:
+    def __init__(self, path="output/pages.segment", text_only=False, level=1):
+        """
+        Append-only, compressed segment file the crawled pages are spooled to
+        The crawler keeps a PageHandle (offset and length) instead of the whole html of the page
+        :param path: str (the file is truncated when the store is created)
+        :param text_only: bool (store only the visible text nodes instead of the whole html)
+        :param level: int (zlib compression level)
+        """
+
+        self.path = path
+        self.text_only = text_only
+        self.level = level
+        self.lock = Lock()
+        self.file = open(path, "wb")
+        self.offset = 0
+        self.raw_bytes = 0  # size of the stored pages before compression
+
+    def put(self, response, document=None):
+        """
+        Appends a page to the segment file
+        :param response: str (html of the page)
+        :param document: PageDocument (used in text only mode, built if missing)
+        :return: PageHandle
+        """
+
+        if self.text_only:
+            document = document or PageDocument(response)
+            data = json.dumps(
+                [
+                    document.text_nodes,
+                    sorted(document.navigation_nodes),
+                    document.structured_addresses,
+                ]
+            ).encode("utf-8")
+        else:
+            data = response.encode("utf-8", errors="replace")
+        compressed = zlib.compress(data, self.level)
+
+        with self.lock:
+            offset = self.offset
+            self.file.write(compressed)
+            self.file.flush()  # readers use their own file descriptor
+            self.offset += len(compressed)
+            self.raw_bytes += len(data)
+
+        return PageHandle(self.path, offset, len(compressed), self.text_only)
+
+    def close(self, remove=True):
+        """
+        Closes the segment file
+        :param remove: bool (delete the file, the handles can no longer be read)
+        """
+
+        with self.lock:
+            self.file.close()
+
+        fd = _read_fds.pop(self.path, None)
+        if fd is not None:
+            os.close(fd)
+        if remove:
+            os.remove(self.path)
@@ -0,0 +1,141 @@
+import os
+from multiprocessing import Pool
+
+from utils.parser import AddressParser
+from utils.metrics import metrics
+from utils.logging_config import setup_logging
+
+# Every worker process builds its own AddressParser once, in the pool initializer
+_worker_parser = None
+
+
+def _init_worker(timeout):
+    """
+    Creates the AddressParser used by the current worker process
+    :param timeout: int
+    """
+
+    global _worker_parser
+    setup_logging(append=True)  # no-op in forked workers, they inherit the handler
+    _worker_parser = AddressParser(timeout=timeout)
+
+
+def _extract_page(page):
+    """
+    Extracts the address candidates from a single page (runs in a worker process)
+    :param page: dict (record of the page, with its document or its html)
+    :return: tuple (dict as in AddressParser.extract_candidates or None if the page could not be parsed,
+                    metrics recorded by the worker for the page)
+    """
+
+    candidates = _worker_parser.extract_candidates([page])
+    return (candidates[0] if candidates else None), metrics.take()
+
+
+class ParallelAddressParser:
+    def __init__(self, address_parser, processes=None, chunksize=4):
+        """
+        Spreads the HTML parsing and the regex scans over a pool of processes
+        Geocoding still happens in the current process, through the given address_parser
+        :param address_parser: AddressParser
+        :param processes: int (defaults to the number of cores)
+        :param chunksize: int (number of pages sent to a worker at once)
+        """
+
+        self.address_parser = address_parser
+        self.chunksize = chunksize
+        self.pool = Pool(
+            processes or os.cpu_count(),
+            initializer=_init_worker,
+            initargs=(address_parser.timeout,),
+        )
+
+    def extract_candidates_many(self, list_of_responses):
+        """
+        Extracts the address candidates of many websites at once
+        The result is in the same order as the input, whatever worker finished first
+        :param list_of_responses: list of lists (one list of responses per website)
+        :return: list of lists (one list of candidates per website)
+        """
+
+        pages = []
+        for responses in list_of_responses:
+            for response in responses:
+                # a page the crawler already parsed (the homepage) is sent as its document, it pickles
+                # compactly and is not parsed again; the others as their html str (lxml would guess the
+                # charset of bytes and garble non-ASCII text) or, when spooled, as their handle
+                if response.get("document") is not None:
+                    page = {
+                        key: value
+                        for key, value in response.items()
+                        if key != "response"
+                    }
+                else:
+                    page = dict(response)
+                pages.append(page)
+
+        results = iter(self.pool.imap(_extract_page, pages, self.chunksize))
+
+        list_of_candidates = []
+        for responses in list_of_responses:
+            candidates = []
+            stopped = False
+            for _ in responses:
+                candidate, worker_metrics = next(results)
+                metrics.merge(worker_metrics)
+                # same as AddressParser.extract_candidates, stop at the first page that could not be parsed
+                if candidate is None:
+                    stopped = True
+                if not stopped:
+                    candidates.append(candidate)
+            list_of_candidates.append(candidates)
+
+        return list_of_candidates
+
+    def extract_candidates(self, responses):
+        """
+        Extracts the address candidates from the responses of a single website
+        :param responses: list
+        :return: list of dicts (one per page, with "domain", "street_address" and "zip_code")
+        """
+
+        if not responses:
+            return []
+
+        return self.extract_candidates_many([responses])[0]
+
+    def resolve_address(self, candidates, output_arr):
+        """
+        Geocodes the candidates of a website (see AddressParser.resolve_address)
+        :param candidates: list
+        :param output_arr: list
+        """
+
+        self.address_parser.resolve_address(candidates, output_arr)
+
+    def resolve_addresses(self, list_of_candidates, output_arr):
+        """
+        Geocodes the candidates of many websites (see AddressParser.resolve_addresses)
+        :param list_of_candidates: list of lists
+        :param output_arr: list
+        """
+
+        self.address_parser.resolve_addresses(list_of_candidates, output_arr)
+
+    def parse_address(self, responses, user_agent, output_arr):
+        """
+        Parses the address from the responses (see AddressParser.parse_address)
+        :param responses: list
+        :param user_agent: str
+        :param output_arr: list
+        """
+
+        self.resolve_address(self.extract_candidates(responses), output_arr)
+
+    def close(self):
+        """
+        Stops the worker processes
+        """
+
+        self.pool.close()
+        self.pool.join()
@@ -2,40 +2,46 @@ import random
 import string
 import re
 import requests
-from bs4 import BeautifulSoup as bs
-from geopy.geocoders import Nominatim
-from geopy.extra.rate_limiter import RateLimiter
 import urllib3
 from colorama import Fore, Style
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
-# Format: country, region, city, postcode, road, and road numbers.
+from utils.document import PageDocument
+from utils.page_store import PageHandle
+from utils.address_scanner import AddressScanner
+from utils.geocoder import GeocodingService, NominatimBackend
+from utils.metrics import metrics
 
-# Set up logging
-logging.basicConfig(
-    filename="output/app.log",
-    filemode="w",
-    format="%(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-)
+# Format: country, region, city, postcode, road, and road numbers.
 
 
 class AddressParser:
-    def __init__(self, timeout=2):
+    def __init__(
+        self,
+        timeout=2,
+        gazetteer=None,
+        crawl_cache=None,
+        geocoder=None,
+    ):
         self.timeout = timeout
-        self.geolocator = Nominatim(user_agent=self.geolocatorRandomUserAgent())
+        self.gazetteer = gazetteer  # PostcodeGazetteer or None
+        self.crawl_cache = crawl_cache  # CrawlCache or None
+        # GeocodingService (it owns the geocode cache), by default Nominatim at one request per second
+        self.geocoder = geocoder or GeocodingService(
+            NominatimBackend(self.geolocatorRandomUserAgent(), timeout)
+        )
         self.zip_code_regex = re.compile(r"\b\d{5}(?:[-\s]\d{4})?\b")
         self.street_regex = re.compile(
             r"(?i)(^|\s)\d{2,7}\b\s+.{5,30}\b\s+(?:road|rd|way|street|st|str|avenue|ave|boulevard|blvd|lane|ln|drive|dr|terrace|ter|place|pl|court|ct)(?:\.|\s|$)"
         )
         self.po_box_regex = re.compile(r"(?i)(?:po|p.o.)\s+(?:box)")
-        self.geocode = RateLimiter(
-            self.geolocator.geocode,
-            max_retries=3,
-            swallow_exceptions=True,
+        self.scanner = AddressScanner(
+            self.street_regex, self.zip_code_regex, self.po_box_regex
         )
 
-    def geolocatorRandomUserAgent(self):
+    @staticmethod
+    def geolocatorRandomUserAgent():
         """
         Generates a random user agent for the geolocator so that it doesn't get blocked / rate limited
         :return: str
@@ -49,15 +55,19 @@ class AddressParser:
 
         return str
 
-    def create_final_address(self, location_from_street, location_from_zip):
+    def create_final_address(
+        self, location_from_street, location_from_zip, gazetteer_address=None
+    ):
         """
         Creates a final address from the street and zip code
+        If the zip code was not geocoded, the address the offline gazetteer has for it is used (if there is one)
         :param location_from_street: dict
         :param location_from_zip: dict
+        :param gazetteer_address: dict (as returned by PostcodeGazetteer.lookup) or None
         :return: dict
         """
 
-        if not location_from_street and not location_from_zip:
+        if not location_from_street and not location_from_zip and not gazetteer_address:
             return None
 
         # Get the raw address from the locations
@@ -67,6 +77,8 @@ class AddressParser:
         address_from_zip = (
             location_from_zip.raw.get("address") if location_from_zip else None
         )
+        if not address_from_zip and gazetteer_address:
+            address_from_zip = gazetteer_address
 
         if not address_from_street and not address_from_zip:
             return None
@@ -109,21 +121,24 @@ class AddressParser:
 
         return field2 or field1
 
-    def get_location(self, soup, regex, url):
+    def get_location(self, document, regex, url):
         """
-        Gets the location from the soup
-        :param soup: BeautifulSoup
+        Gets the location from the text nodes of the document
+        :param document: PageDocument
         :param regex: re / str
         :param url: str
         :return: str
         """
 
         try:
-            for val in soup.find_all(string=regex):
+            for val in document.text_nodes:
                 if (
                     len(val) <= 100
                 ):  # if the string is too long, it's probably not an address
-                    location = re.search(regex, val).group(0)
+                    match = re.search(regex, val)
+                    if not match:
+                        continue
+                    location = match.group(0)
                     location = re.sub(self.po_box_regex, "", location)
                     return location
         except AttributeError:
@@ -142,44 +157,159 @@ class AddressParser:
             )
         return None
 
-    def parse_address(self, responses, user_agent, output_arr):
+    def extract_candidates(self, responses):
         """
-        Parses the address from the responses
+        Extracts the street address and zip code candidates from the responses
+        This part is CPU bound and does not touch the network
         :param responses: list
-        :param user_agent: str
-        :param output_arr: list
+        :return: list of dicts (one per page, with "domain", "url", "street_address" and "zip_code")
+        A page that publishes its address as structured data gets a "structured_address" instead, it is not scanned
         """
 
-        list_of_street_addresses = []
-        list_of_zip_codes = []
+        candidates = []
         if not responses:
-            return
+            return candidates
 
-        urllib3.disable_warnings()
         for response in responses:
             url = response.get("domain")
 
+            # the page did not change since the previous crawl, its address is reused
+            if response.get("cached_address"):
+                candidates.append(
+                    {
+                        "domain": url,
+                        "url": response.get("url"),
+                        "cached_address": response.get("cached_address"),
+                    }
+                )
+                continue
+
             try:
-                soup = bs(response.get("response"), "lxml")
+                # the crawler already parsed the page for its links, reuse that document
+                document = response.get("document")
+                body = response.get("response")
+                with metrics.timer("parse_seconds"):
+                    if document is None and isinstance(body, PageHandle):
+                        document = body.load_document()
+                    elif document is None:
+                        document = PageDocument(body)
             except Exception as e:
+                metrics.increment("errors_total", stage="parse")
                 print(
                     f"{Fore.RED}Error occurred while {Fore.YELLOW}parsing{Fore.RED} page {url}. Error: {e}{Style.RESET_ALL}"
                 )
                 logging.error(f"Error occurred while parsing page {url}. Error: {e}")
+                break
+
+            if document.structured_addresses:
+                candidates.append(
+                    {
+                        "domain": url,
+                        "url": response.get("url"),
+                        "structured_address": document.structured_addresses[0],
+                    }
+                )
+                continue
+
+            try:
+                with metrics.timer("scan_seconds"):
+                    street_address, zip_code = self.scanner.best(
+                        self.scanner.scan(document)
+                    )
+            except Exception as e:
+                metrics.increment("errors_total", stage="scan")
+                print(
+                    f"{Fore.RED}Unexpected error {e} occurred while getting location from {url}{Style.RESET_ALL}"
+                )
+                logging.error(
+                    f"Unexpected error {e} occurred while getting location from {url}"
+                )
+                street_address, zip_code = None, None
+
+            candidates.append(
+                {
+                    "domain": url,
+                    "url": response.get("url"),
+                    "street_address": street_address,
+                    "zip_code": zip_code,
+                }
+            )
+
+        return candidates
+
+    def resolve_address(self, candidates, output_arr):
+        """
+        Geocodes the candidates of a website and appends the first valid address to the output
+        An address published as structured data is used as is, whatever page it is on, nothing is geocoded
+        :param candidates: list (as returned by extract_candidates)
+        :param output_arr: list
+        """
+
+        for candidate in candidates:
+            structured_address = candidate.get("structured_address")
+            if structured_address:
+                url = candidate.get("domain")
+                metrics.increment("addresses_total", source="structured_data")
+                output_arr.append({"domain": url, "address": structured_address})
+                if self.crawl_cache and candidate.get("url"):
+                    self.crawl_cache.set_address(
+                        url, candidate.get("url"), structured_address
+                    )
                 return
 
-            street_address = self.get_location(soup, self.street_regex, url)
-            zip_code = self.get_location(soup, self.zip_code_regex, url)
+        list_of_street_addresses = []
+        list_of_zip_codes = []
+
+        # the zip codes of all the pages are looked up in the gazetteer at once
+        gazetteer_addresses = {}
+        zip_codes = list(
+            dict.fromkeys(
+                candidate["zip_code"]
+                for candidate in candidates
+                if candidate.get("zip_code")
+            )
+        )
+        if self.gazetteer and zip_codes:
+            gazetteer_addresses = dict(
+                zip(zip_codes, self.gazetteer.lookup_many(zip_codes))
+            )
+
+        urllib3.disable_warnings()
+        for candidate in candidates:
+            url = candidate.get("domain")
+            street_address = candidate.get("street_address")
+            zip_code = candidate.get("zip_code")
+
+            if candidate.get("cached_address"):
+                metrics.increment("addresses_total", source="crawl_cache")
+                output_arr.append(
+                    {"domain": url, "address": candidate.get("cached_address")}
+                )
+                break
 
             location_from_street = None
             location_from_zip = None
+            street_lookup = None
+            zip_lookup = None
+
+            if zip_code and zip_code in list_of_zip_codes:
+                zip_code = None
+            elif zip_code:
+                list_of_zip_codes.append(zip_code)
 
+            # both lookups are sent to the geocoding service before waiting for either of them
             if street_address and street_address not in list_of_street_addresses:
                 list_of_street_addresses.append(street_address)
+                street_lookup = self.geocoder.submit(street_address)
+
+            # zip codes known by the gazetteer are resolved offline, they are not geocoded
+            gazetteer_address = gazetteer_addresses.get(zip_code)
+            if zip_code and not gazetteer_address:
+                zip_lookup = self.geocoder.submit(zip_code)
+
+            if street_lookup:
                 try:
-                    location_from_street = self.geolocator.geocode(
-                        street_address, addressdetails=True, timeout=self.timeout
-                    )
+                    location_from_street = street_lookup.result()
                 except Exception as e:
                     print(
                         f"{Fore.RED}Error validating location from the street_address {street_address} from page {url}. Error: {e}{Style.RESET_ALL}"
@@ -188,10 +318,9 @@ class AddressParser:
                         f"Error validating location from the street_address {street_address} from page {url}. Error: {e}"
                     )
 
-            if zip_code and zip_code not in list_of_zip_codes:
-                list_of_zip_codes.append(zip_code)
+            if zip_lookup:
                 try:
-                    location_from_zip = self.geolocator.geocode(zip_code)
+                    location_from_zip = zip_lookup.result()
                 except Exception as e:
                     print(
                         f"{Fore.RED}Error validating location from the zip_code {zip_code} from page {url}. Error: {e}{Style.RESET_ALL}"
@@ -203,7 +332,7 @@ class AddressParser:
             final_address = None
             try:
                 final_address = self.create_final_address(
-                    location_from_street, location_from_zip
+                    location_from_street, location_from_zip, gazetteer_address
                 )
             except Exception as e:
                 print(
@@ -212,7 +341,37 @@ class AddressParser:
                 logging.error(f"Error getting final address from page {url}. Error {e}")
 
             if final_address:
+                metrics.increment("addresses_total", source="geocoder")
                 output_arr.append({"domain": url, "address": final_address})
+                if self.crawl_cache and candidate.get("url"):
+                    self.crawl_cache.set_address(
+                        url, candidate.get("url"), final_address
+                    )
                 break  # we only need one address per website
 
-            return
+    def resolve_addresses(self, list_of_candidates, output_arr):
+        """
+        Geocodes the candidates of many websites concurrently, one website per geocoding worker
+        The addresses are appended in the order of the websites
+        :param list_of_candidates: list of lists (as returned by extract_candidates)
+        :param output_arr: list
+        """
+
+        def resolve(candidates):
+            addresses = []
+            self.resolve_address(candidates, addresses)
+            return addresses
+
+        with ThreadPoolExecutor(self.geocoder.workers) as executor:
+            for addresses in executor.map(resolve, list_of_candidates):
+                output_arr.extend(addresses)
+
+    def parse_address(self, responses, user_agent, output_arr):
+        """
+        Parses the address from the responses
+        :param responses: list
+        :param user_agent: str
+        :param output_arr: list
+        """
+
+        self.resolve_address(self.extract_candidates(responses), output_arr)
@@ -0,0 +1,236 @@
+import logging
+from queue import Queue
+from threading import Thread, Event, Lock
+from colorama import Fore, Style
+
+from utils.metrics import metrics
+
+_STOP = object()  # sentinel that tells a stage worker to exit
+
+
+class AddressPipeline:
+    def __init__(
+        self,
+        crawler,
+        address_parser,
+        user_agent_provider,
+        num_crawlers=40,
+        num_parsers=2,
+        num_geocoders=2,
+        queue_size=100,
+        report_interval=5,
+        checkpoint=None,
+        commit_size=100,
+        parse_while_crawling=False,
+    ):
+        self.crawler = crawler
+        self.address_parser = address_parser
+        self.user_agent_provider = user_agent_provider
+        self.num_crawlers = num_crawlers
+        self.num_parsers = num_parsers
+        self.num_geocoders = num_geocoders
+        self.report_interval = report_interval
+        self.checkpoint = (
+            checkpoint  # Checkpoint the finished domains are committed to, or None
+        )
+        self.commit_size = commit_size
+        # the crawl workers parse and geocode every page as it arrives and stop at the first address,
+        # the parse and geocode stages stay idle
+        self.parse_while_crawling = parse_while_crawling
+
+        # input domains finished since the last commit and their addresses
+        self.commit_lock = Lock()
+        self.finished_domains = []
+        self.finished_addresses = []
+        self.addresses_found = 0
+
+        # Bounded queues between the stages, a full queue blocks the previous stage (backpressure)
+        self.domain_queue = Queue(maxsize=queue_size)
+        self.parse_queue = Queue(maxsize=queue_size)
+        self.geocode_queue = Queue(maxsize=queue_size)
+
+        self.max_depths = {"crawl": 0, "parse": 0, "geocode": 0}
+        self._done = Event()
+
+    def queue_depths(self):
+        """
+        Returns the current number of items waiting in front of each stage
+        :return: dict
+        """
+
+        return {
+            "crawl": self.domain_queue.qsize(),
+            "parse": self.parse_queue.qsize(),
+            "geocode": self.geocode_queue.qsize(),
+        }
+
+    def finish(self, domains, addresses=()):
+        """
+        Records input domains that went through the pipeline (or left it early: dead, alias, nothing found)
+        They are committed to the checkpoint every commit_size domains, so the addresses are not all kept in memory
+        :param domains: list of str
+        :param addresses: list (the addresses found for the domains)
+        """
+
+        with self.commit_lock:
+            self.finished_domains.extend(domains)
+            self.finished_addresses.extend(addresses)
+            self.addresses_found += len(addresses)
+            if len(self.finished_domains) >= self.commit_size:
+                self.commit()
+
+    def commit(self):
+        """
+        Commits the finished domains to the checkpoint, the caller holds the commit lock
+        If the commit fails, the domains are kept and committed with the next ones
+        """
+
+        if self.checkpoint and self.finished_domains:
+            try:
+                self.checkpoint.commit_chunk(
+                    self.finished_domains, self.finished_addresses
+                )
+            except Exception as e:
+                metrics.increment("errors_total", stage="checkpoint")
+                logging.error(f"Error occurred while saving the checkpoint. Error: {e}")
+                return
+        self.finished_domains = []
+        self.finished_addresses = []
+
+    def crawl_worker(self):
+        """
+        Takes domains from the domain queue and pushes the crawled responses to the parse queue
+        """
+
+        while True:
+            domain = self.domain_queue.get()
+            if domain is _STOP:
+                break
+
+            responses = []
+            addresses = []
+            # with an adaptive controller, only the allowed number of workers crawl at the same time
+            controller = self.crawler.controller
+            if controller:
+                controller.acquire()
+            try:
+                user_agent = self.user_agent_provider.get_random_user_agent()
+                if self.parse_while_crawling:
+                    self.crawler.crawl_and_parse(
+                        domain, user_agent, self.address_parser, addresses
+                    )
+                else:
+                    self.crawler.crawl_website(domain, user_agent, responses)
+            except Exception as e:
+                metrics.increment("errors_total", stage="crawl")
+                logging.error(f"Error occurred while crawling {domain}. Error: {e}")
+            finally:
+                if controller:
+                    controller.release()
+
+            if not responses:
+                self.finish([domain], addresses)
+            for element in responses:
+                self.parse_queue.put((domain, element))
+
+    def parse_worker(self):
+        """
+        Takes crawled responses from the parse queue and pushes the address candidates to the geocode queue
+        """
+
+        while True:
+            item = self.parse_queue.get()
+            if item is _STOP:
+                break
+
+            domain, responses = item
+            candidates = []
+            try:
+                candidates = self.address_parser.extract_candidates(responses)
+            except Exception as e:
+                metrics.increment("errors_total", stage="parse")
+                logging.error(f"Error occurred while parsing {domain}. Error: {e}")
+
+            if candidates:
+                self.geocode_queue.put((domain, candidates))
+            else:
+                self.finish([domain])
+
+    def geocode_worker(self):
+        """
+        Takes address candidates from the geocode queue and finishes their domain with the validated address
+        The rate limit of the geocoder is enforced by the geocoding service shared by all the workers
+        """
+
+        while True:
+            item = self.geocode_queue.get()
+            if item is _STOP:
+                break
+
+            domain, candidates = item
+            print(
+                f"{Fore.LIGHTGREEN_EX}[{self.addresses_found + 1}] {Style.RESET_ALL}Extracting address from {candidates[0].get('domain')}{Style.RESET_ALL}"
+            )
+            addresses = []
+            try:
+                self.address_parser.resolve_address(candidates, addresses)
+            except Exception as e:
+                metrics.increment("errors_total", stage="geocode")
+                logging.error(f"Error occurred while geocoding {domain}. Error: {e}")
+            self.finish([domain], addresses)
+
+    def report_worker(self):
+        """
+        Periodically prints the queue depths of every stage
+        """
+
+        while not self._done.wait(self.report_interval):
+            depths = self.queue_depths()
+            for stage, depth in depths.items():
+                self.max_depths[stage] = max(self.max_depths[stage], depth)
+
+            print(
+                f"{Fore.CYAN}Queue depths: {Style.RESET_ALL}"
+                + ", ".join(f"{stage}={depth}" for stage, depth in depths.items())
+            )
+
+    def run(self, domains):
+        """
+        Runs the crawl -> parse -> geocode pipeline over the domains
+        Every stage starts working as soon as its first item is ready, the finished domains are committed
+        to the checkpoint along the way and the last ones once every stage is done
+        :param domains: iterable of str
+        :return: dict (maximum observed queue depth per stage)
+        """
+
+        crawlers = [Thread(target=self.crawl_worker) for _ in range(self.num_crawlers)]
+        parsers = [Thread(target=self.parse_worker) for _ in range(self.num_parsers)]
+        geocoders = [
+            Thread(target=self.geocode_worker) for _ in range(self.num_geocoders)
+        ]
+        reporter = Thread(target=self.report_worker, daemon=True)
+
+        for t in [*crawlers, *parsers, *geocoders, reporter]:
+            t.start()
+
+        for domain in domains:
+            self.domain_queue.put(domain)
+
+        # Shut the stages down in order, each one only after the previous stage has drained
+        for stage_threads, stage_queue in [
+            (crawlers, self.domain_queue),
+            (parsers, self.parse_queue),
+            (geocoders, self.geocode_queue),
+        ]:
+            for _ in stage_threads:
+                stage_queue.put(_STOP)
+            for t in stage_threads:
+                t.join()
+
+        with self.commit_lock:
+            self.commit()
+
+        self._done.set()
+        reporter.join()
+
+        return self.max_depths
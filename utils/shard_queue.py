@@ -0,0 +1,178 @@
+import json
+import os
+import sqlite3
+import time
+from threading import Event, Lock, Thread
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+
+
+class ShardQueue:
+    def __init__(self, path="output/shards.sqlite", lease_seconds=600):
+        """
+        Work queue of domain shards in a SQLite file, shared by the worker processes of one machine
+        (or of several machines, if the file is on a shared filesystem with working POSIX locks, e.g. NFSv4)
+        A worker claims a shard with a lease, renews the lease while it works on the shard and completes it
+        with the path of its output; a shard whose lease expired (the worker crashed or hung) is claimed again
+        :param path: str
+        :param lease_seconds: float (how long a claim stays valid without being renewed)
+        """
+
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.lock = Lock()
+        # autocommit, the transactions are opened explicitly with BEGIN IMMEDIATE
+        self.connection = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        # rollback journal, not WAL: WAL needs memory shared by all the processes, so it only works on one host
+        self.connection.execute("PRAGMA journal_mode=DELETE")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS shards (id INTEGER PRIMARY KEY, domains TEXT, status TEXT, "
+            "owner TEXT, lease_expires REAL, attempts INTEGER DEFAULT 0, output_path TEXT)"
+        )
+
+        self.stats = {"claimed": 0, "expired_leases": 0, "completed": 0}
+
+    def create(self, domains, shard_size):
+        """
+        Replaces the content of the queue with the domains, split into shards
+        :param domains: list of str
+        :param shard_size: int (number of domains per shard)
+        :return: int (number of shards)
+        """
+
+        shards = [
+            (json.dumps(domains[index : index + shard_size]), PENDING)
+            for index in range(0, len(domains), shard_size)
+        ]
+
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.execute("DELETE FROM shards")
+            self.connection.executemany(
+                "INSERT INTO shards (domains, status) VALUES (?, ?)", shards
+            )
+            self.connection.execute("COMMIT")
+
+        return len(shards)
+
+    def claim(self, owner):
+        """
+        Leases the first shard that is pending or whose lease expired
+        :param owner: str (id of the worker)
+        :return: tuple (shard id, list of domains) or None if there is nothing left to claim
+        """
+
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute(
+                    "SELECT id, domains, status FROM shards "
+                    "WHERE status = ? OR (status = ? AND lease_expires < ?) ORDER BY id LIMIT 1",
+                    (PENDING, LEASED, now),
+                ).fetchone()
+                if row:
+                    self.connection.execute(
+                        "UPDATE shards SET status = ?, owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                        "WHERE id = ?",
+                        (LEASED, owner, now + self.lease_seconds, row[0]),
+                    )
+            finally:
+                self.connection.execute("COMMIT")
+
+        if not row:
+            return None
+
+        self.stats["claimed"] += 1
+        if row[2] == LEASED:
+            self.stats["expired_leases"] += 1
+        return row[0], json.loads(row[1])
+
+    def renew(self, shard_id, owner):
+        """
+        Extends the lease of a shard
+        :param shard_id: int
+        :param owner: str
+        :return: bool (False if the lease expired and the shard was claimed by another worker)
+        """
+
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE shards SET lease_expires = ? WHERE id = ? AND owner = ? AND status = ?",
+                (time.time() + self.lease_seconds, shard_id, owner, LEASED),
+            )
+        return cursor.rowcount == 1
+
+    def keep_leased(self, shard_id, owner):
+        """
+        Renews the lease of a shard in the background, three times per lease period, until the event is set
+        :param shard_id: int
+        :param owner: str
+        :return: threading.Event
+        """
+
+        stop = Event()
+
+        def renew_worker():
+            while not stop.wait(self.lease_seconds / 3):
+                if not self.renew(shard_id, owner):
+                    break
+
+        Thread(target=renew_worker, daemon=True).start()
+        return stop
+
+    def complete(self, shard_id, owner, output_path):
+        """
+        Marks a shard as done
+        :param shard_id: int
+        :param owner: str
+        :param output_path: str (parquet file with the addresses of the shard)
+        :return: bool (False if the shard is no longer leased by this worker, its output must be dropped)
+        """
+
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE shards SET status = ?, output_path = ? WHERE id = ? AND owner = ? AND status = ?",
+                (DONE, output_path, shard_id, owner, LEASED),
+            )
+
+        if cursor.rowcount == 1:
+            self.stats["completed"] += 1
+            return True
+        return False
+
+    def progress(self):
+        """
+        Counts the shards by status
+        :return: dict (status -> number of shards)
+        """
+
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT status, COUNT(*) FROM shards GROUP BY status"
+            ).fetchall()
+        return {PENDING: 0, LEASED: 0, DONE: 0, **dict(rows)}
+
+    def outputs(self):
+        """
+        Returns the outputs of the finished shards, in shard order
+        :return: list of str
+        """
+
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT output_path FROM shards WHERE status = ? ORDER BY id", (DONE,)
+            ).fetchall()
+        return [path for (path,) in rows if path and os.path.exists(path)]
+
+    def close(self):
+        """
+        Closes the SQLite connection
+        """
+
+        with self.lock:
+            self.connection.close()
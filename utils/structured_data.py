@@ -0,0 +1,156 @@
+import json
+import re
+
+from lxml import etree
+
+# Pages without any of these strings have no structured address, they are not searched
+MARKERS = ("PostalAddress", "adr")
+
+_find_json_ld = etree.XPath(
+    '//script[contains(@type, "ld+json")]/text()', smart_strings=False
+)
+_find_microdata = etree.XPath('//*[contains(@itemtype, "PostalAddress")]')
+_find_hcards = etree.XPath(
+    '//*[contains(concat(" ", normalize-space(@class), " "), " adr ")]'
+)
+
+# schema.org PostalAddress property / hCard class -> field of the final address
+SCHEMA_ORG_FIELDS = {
+    "addressCountry": "country",
+    "addressRegion": "region",
+    "addressLocality": "city",
+    "postalCode": "postcode",
+    "streetAddress": "street",
+}
+HCARD_FIELDS = {
+    "country-name": "country",
+    "region": "region",
+    "locality": "city",
+    "postal-code": "postcode",
+    "street-address": "street",
+}
+
+_house_number_regex = re.compile(r"^\s*(\d+[a-zA-Z]?(?:-\d+)?)\s+(.+)$")
+
+
+def has_markers(response):
+    """
+    Cheap check, on the raw page, for anything that could be a structured address
+    :param response: str or bytes (html of the page)
+    :return: bool
+    """
+
+    if isinstance(response, bytes):
+        return any(marker.encode() in response for marker in MARKERS)
+    return any(marker in response for marker in MARKERS)
+
+
+def _text(value):
+    if isinstance(
+        value, dict
+    ):  # e.g. "addressCountry": {"@type": "Country", "name": "US"}
+        value = value.get("name")
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if not isinstance(value, str):
+        return None
+    return " ".join(value.split()) or None
+
+
+def to_final_address(fields):
+    """
+    Maps the fields of a structured address to the output of AddressParser.create_final_address
+    :param fields: dict ("country", "region", "city", "postcode", "street")
+    :return: dict or None if there is neither a street nor a postcode
+    """
+
+    street = fields.get("street")
+    if not street and not fields.get("postcode"):
+        return None
+
+    road, house_number = street, None
+    match = _house_number_regex.match(street) if street else None
+    if match:
+        house_number, road = match.group(1), match.group(2)
+
+    return {
+        "country": fields.get("country"),
+        "region": fields.get("region"),
+        "city": fields.get("city"),
+        "postcode": fields.get("postcode"),
+        "road": road,
+        "house_number": house_number,
+    }
+
+
+def _iter_json_ld_addresses(data):
+    if isinstance(data, list):
+        for item in data:
+            yield from _iter_json_ld_addresses(item)
+    elif isinstance(data, dict):
+        types = data.get("@type")
+        types = types if isinstance(types, list) else [types]
+        if "PostalAddress" in types:
+            yield data
+            return
+
+        for key, value in data.items():
+            if key == "address" and isinstance(value, dict) and "@type" not in value:
+                yield value  # "address": {"streetAddress": ...} without a type
+            else:
+                yield from _iter_json_ld_addresses(value)
+
+
+def _from_json_ld(tree):
+    for block in _find_json_ld(tree):
+        try:
+            data = json.loads(block)
+        except ValueError:
+            continue
+
+        for address in _iter_json_ld_addresses(data):
+            yield {
+                field: _text(address.get(name))
+                for name, field in SCHEMA_ORG_FIELDS.items()
+            }
+
+
+def _from_microdata(tree):
+    for element in _find_microdata(tree):
+        fields = {}
+        for prop in element.iter():
+            field = SCHEMA_ORG_FIELDS.get(prop.get("itemprop"))
+            if field and field not in fields:
+                fields[field] = _text(prop.get("content") or prop.text_content())
+        yield fields
+
+
+def _from_hcards(tree):
+    for element in _find_hcards(tree):
+        fields = {}
+        for prop in element.iter():
+            if not isinstance(prop.tag, str):
+                continue
+            for name in (prop.get("class") or "").split():
+                field = HCARD_FIELDS.get(name)
+                if field and field not in fields:
+                    fields[field] = _text(prop.text_content())
+        yield fields
+
+
+def extract_structured_addresses(tree):
+    """
+    Finds the schema.org PostalAddress (JSON-LD or microdata) and hCard addresses of a page
+    :param tree: lxml html tree
+    :return: list of dicts (in the create_final_address format), most complete first
+    """
+
+    addresses = []
+    for extract in (_from_json_ld, _from_microdata, _from_hcards):
+        for fields in extract(tree):
+            address = to_final_address(fields)
+            if address and address not in addresses:
+                addresses.append(address)
+
+    # sorted is stable, so with the same number of fields JSON-LD comes before microdata and hCard
+    return sorted(addresses, key=lambda address: -sum(1 for v in address.values() if v))